@@ -11,11 +11,13 @@ import random
 import sys
 import time
 
+import neonmeate.nmpd.aio as aio
 import neonmeate.nmpd.mpdlib as nmpd
 import neonmeate.ui.app as app
 import neonmeate.ui.toolkit as toolkit
 import neonmeate.util.art as artcache
 import neonmeate.util.config as config
+import neonmeate.util.imagepool as imagepool
 import neonmeate.util.thread as thread
 
 
@@ -73,10 +75,23 @@ def main(args=None):
 
     with thread.ScheduledExecutor(log_errors, log_errors) as executor:
         connstatus = nmpd.MpdConnectionStatus()
-        mpdclient = nmpd.Mpd(executor, configstate, connstatus)
+        loop = None
+        async_client = None
+        if cfg.mpd_use_asyncio():
+            loop = aio.glib_event_loop()
+            async_client = aio.AsyncMpd(cfg.mpd_host(), cfg.mpd_port(), loop)
+            async_client.start()
+        mpdclient = nmpd.Mpd(executor, configstate, connstatus, async_client)
         hb_interval = cfg.mpd_hb_interval()
-        hb = nmpd.MpdHeartbeat(mpdclient, hb_interval, executor, connstatus)
-        art_cache = artcache.ArtCache(configstate, executor)
+        hb = nmpd.MpdHeartbeat(
+            mpdclient,
+            hb_interval,
+            executor,
+            connstatus,
+            cfg.mpd_use_idle()
+        )
+        image_pool = imagepool.ImagePool()
+        art_cache = artcache.ArtCache(configstate, executor, image_pool)
 
         main_window = app.App(
             rng,
@@ -89,7 +104,12 @@ def main(args=None):
             connstatus
         )
 
-        main_window.connect('destroy', Gtk.main_quit)
+        if loop is not None:
+            # The asyncio loop runs the GLib main loop in place of
+            # Gtk.main()
+            main_window.connect('destroy', lambda w: loop.stop())
+        else:
+            main_window.connect('destroy', Gtk.main_quit)
         main_window.set_title('NeonMeate')
         main_window.show_all()
 
@@ -104,10 +124,18 @@ def main(args=None):
                 )
 
         connect()
-        Gtk.main()
+        if loop is not None:
+            loop.run_forever()
+        else:
+            Gtk.main()
         hb.stop()
         cfg.set_connected(connstatus.is_connected())
+        mpdclient.close()
+        if async_client is not None:
+            async_client.stop()
         cfg.save(config.main_config_file())
+        art_cache.save()
+        image_pool.shutdown()
         logging.shutdown()
 
 
@@ -68,6 +68,10 @@ class Album:
         self.title = title
         self.dirpath = dirpath
         self.art = None
+        # True when the songs are exactly the songs under dirpath with
+        # this title, in database order, so that the album can be
+        # enqueued on the server with a filter on both.
+        self.complete = False
 
     def __str__(self):
         return f'Album:title={self.title}, ' \
@@ -0,0 +1,257 @@
+import asyncio
+import logging
+import threading
+
+import mpd.asyncio as mpd_aio
+
+import neonmeate.util.metadata as mpdmeta
+
+from ..model import Artist
+from ..ui.toolkit import glib_main
+from .library import assemble_albums, mark_complete
+
+
+try:
+    from gi.events import GLibEventLoopPolicy
+except ImportError:
+    GLibEventLoopPolicy = None
+
+
+def glib_event_loop():
+    """
+    Returns an asyncio event loop that runs on the GLib main context of
+    the calling thread, which should be the main thread, or None if
+    PyGObject is too old (before 3.50) to provide one. Running the loop
+    runs the GLib main loop, so it can take the place of Gtk.main().
+    """
+    if GLibEventLoopPolicy is None:
+        return None
+    return GLibEventLoopPolicy().get_event_loop()
+
+
+class AsyncMpd:
+    """
+    An alternative to the Mpd client built on python-mpd2's asyncio
+    client. Instead of taking callbacks, the query methods are
+    coroutines, and each call has its own timeout. python-mpd2 writes
+    each command to the socket in the call that issues it and reads the
+    responses in order, so commands that are awaited together are all
+    sent before the first response arrives, e.g.
+
+        status, song = await asyncio.gather(
+            mpd.status(),
+            mpd.currentsong()
+        )
+
+    makes a single round trip on the one connection.
+
+    Given a GLib event loop (see glib_event_loop()), the coroutines run
+    on the GTK main thread as part of the GLib main loop. Otherwise the
+    client runs an asyncio event loop on a thread of its own. Either
+    way, code on any thread uses submit() to schedule a coroutine, and
+    gets the result back on the main thread through a callback.
+
+    The connection is made on first use, and again after it was lost
+    or disconnect() was called.
+    """
+
+    Timeout = 10
+
+    def __init__(self, host, port, loop=None, timeout=Timeout):
+        self._host = host
+        self._port = port
+        self._timeout = timeout
+        self._client = mpd_aio.MPDClient()
+        self._connecting = None
+        self._thread = None
+        self._loop = loop
+        if loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(
+                target=self._run_loop,
+                name='MpdAsyncio',
+                daemon=True
+            )
+        self.logger = logging.getLogger(__name__)
+
+    def start(self):
+        """
+        Starts the thread running the event loop, if the client has
+        one. A GLib event loop runs along with the GLib main loop.
+        """
+        if self._thread is not None:
+            self._thread.start()
+
+    def stop(self):
+        """
+        Disconnects, and stops the event loop of the client's own
+        thread, waiting for it to end. This should be called on the
+        main thread.
+        """
+        if self._thread is None:
+            self._client.disconnect()
+            return
+
+        if not self._thread.is_alive():
+            # Never started, or already stopped
+            if not self._loop.is_closed():
+                self._loop.close()
+            return
+
+        def stop_loop():
+            self._client.disconnect()
+            self._loop.stop()
+
+        self._loop.call_soon_threadsafe(stop_loop)
+        self._thread.join()
+
+    def set_host(self, host, port):
+        """
+        Makes the client use another server from the next command on.
+        This can be called from any thread.
+        """
+
+        def change():
+            self._host = host
+            self._port = port
+            self._client.disconnect()
+
+        self._loop.call_soon_threadsafe(change)
+
+    def disconnect(self):
+        """Closes the connection. This can be called from any thread."""
+        self._loop.call_soon_threadsafe(self._client.disconnect)
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        try:
+            self._loop.run_forever()
+        finally:
+            # Lets the tasks that are left wind down
+            pending = asyncio.all_tasks(self._loop)
+            for task in pending:
+                task.cancel()
+            self._loop.run_until_complete(
+                asyncio.gather(*pending, return_exceptions=True)
+            )
+            self._loop.close()
+
+    def submit(self, coro, callback=None):
+        """
+        Schedules the coroutine on the event loop. This can be called
+        from any thread. If a callback is given, it is called on the
+        GTK main thread with the result. Failures are logged.
+
+        :return: a concurrent.futures.Future for the result, which can
+        be used to cancel the coroutine.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+        @glib_main
+        def on_main(result):
+            callback(result)
+
+        def on_done(f):
+            if f.cancelled():
+                return
+            e = f.exception()
+            if e is not None:
+                self.logger.error(f'MPD request failed: {e!r}')
+            elif callback is not None:
+                on_main(f.result())
+
+        future.add_done_callback(on_done)
+        return future
+
+    def is_connected(self):
+        return self._client.connected
+
+    async def connect(self, timeout=None):
+        """
+        Connects unless already connected. Commands issued while the
+        connection is being made wait for it, rather than making one of
+        their own.
+        """
+        if self._client.connected:
+            return
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._with_timeout(
+                self._client.connect(self._host, self._port),
+                timeout
+            ))
+        connecting = self._connecting
+        try:
+            await asyncio.shield(connecting)
+        finally:
+            if self._connecting is connecting and connecting.done():
+                self._connecting = None
+
+    async def command(self, name, *args, timeout=None):
+        """
+        Sends any command the client supports, e.g.
+        await mpd.command('setvol', 50).
+        """
+        await self.connect(timeout)
+        return await self._with_timeout(
+            getattr(self._client, name)(*args),
+            timeout
+        )
+
+    async def status(self, timeout=None):
+        return await self.command('status', timeout=timeout)
+
+    async def currentsong(self, timeout=None):
+        return await self.command('currentsong', timeout=timeout)
+
+    async def playlistinfo(self, timeout=None):
+        return await self.command('playlistinfo', timeout=timeout)
+
+    async def find_artists(self, include_comps, timeout=None):
+        """Returns the artists in the database as sorted Artist instances."""
+        keys = [mpdmeta.ALBUMARTIST_KEY]
+        if include_comps:
+            keys.append(mpdmeta.ARTIST_KEY)
+        results = await asyncio.gather(
+            *[self.command('list', key, timeout=timeout) for key in keys]
+        )
+        artists = set()
+        for records in results:
+            for record in records:
+                artist = Artist.create(record)
+                if artist:
+                    artists.add(artist)
+        return sorted(list(artists))
+
+    async def find_albums(self, artist, timeout=None):
+        """
+        Returns the albums the artist appears on, as Album instances in
+        chronological order. The songs under each album's directory are
+        fetched as well, to tell whether the album is complete.
+        """
+        by_albumartist, by_artist = await asyncio.gather(
+            self.command(
+                'find',
+                mpdmeta.ALBUMARTIST_KEY,
+                artist.name,
+                timeout=timeout
+            ),
+            self.command(
+                'find',
+                mpdmeta.ARTIST_KEY,
+                artist.name,
+                timeout=timeout
+            )
+        )
+        albums = assemble_albums(artist, by_albumartist, by_artist)
+        under_dirs = await asyncio.gather(*[
+            self.command('find', 'base', album.dirpath, timeout=timeout)
+            for album in albums
+        ])
+        for album, songs in zip(albums, under_dirs):
+            mark_complete(album, songs)
+        return albums
+
+    async def _with_timeout(self, awaitable, timeout):
+        if timeout is None:
+            timeout = self._timeout
+        return await asyncio.wait_for(awaitable, timeout)
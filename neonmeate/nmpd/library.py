@@ -0,0 +1,307 @@
+import bisect
+import json
+import logging
+import os
+
+from array import array
+
+import neonmeate.util.metadata as mpdmeta
+
+from neonmeate.util.metadata import parse_date
+from ..model import Album, Artist, Song
+
+
+def assemble_albums(artist, *song_lists):
+    """
+    Groups the songs (dictionaries as returned by MPD) into albums by
+    album title, date and directory, and returns a list of Album
+    instances for the artist in chronological order. A song appearing
+    in more than one of the lists is only included once.
+    """
+    songs_by_album = {}
+    songset = set()
+    for songs in song_lists:
+        for song in songs:
+            if mpdmeta.ALBUM_KEY in song:
+                album_name = song[mpdmeta.ALBUM_KEY]
+                date = parse_date(song.get(mpdmeta.DATE_KEY))
+                directory = os.path.dirname(song[mpdmeta.FILE_KEY])
+                key = (album_name, date, directory)
+                songlist = songs_by_album.setdefault(key, [])
+                s = Song.create(song)
+                if s not in songset:
+                    songlist.append(s)
+                    songset.add(s)
+
+    albums = []
+    for (title, date, directory), songs in songs_by_album.items():
+        albums.append(Album(artist, title, date, songs, directory))
+    return Album.sorted_chrono(albums)
+
+
+def mark_complete(album, songs):
+    """
+    Sets album.complete, given the songs (dictionaries as returned by
+    MPD) under the album's directory, subdirectories included. The
+    album is complete when these hold exactly its songs under its
+    title, so that a single findadd can enqueue it.
+    """
+    found = [
+        song[mpdmeta.FILE_KEY]
+        for song in songs
+        if LibraryIndex._has_tag(song, mpdmeta.ALBUM_KEY, album.title)
+    ]
+    album.complete = found == [s.file for s in album.sorted_songs()]
+
+
+class UriTable:
+    """
+    The song URIs of the library packed into a single UTF-8 buffer,
+    with an array of offsets marking where each one starts. This takes
+    a fraction of the memory of a list of strings, and picking random
+    songs only decodes the URIs that were picked.
+    """
+
+    def __init__(self, uris):
+        self._offsets = array('Q', [0])
+        chunks = []
+        end = 0
+        for uri in uris:
+            encoded = uri.encode('utf-8')
+            chunks.append(encoded)
+            end += len(encoded)
+            self._offsets.append(end)
+        self._blob = b''.join(chunks)
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, i):
+        start, end = self._offsets[i], self._offsets[i + 1]
+        return self._blob[start:end].decode('utf-8')
+
+    def sample(self, rng, k):
+        """
+        Returns k distinct URIs picked at random using rng, or all of
+        them in random order if there are fewer than k.
+        """
+        indices = rng.sample(range(len(self)), min(k, len(self)))
+        return [self[i] for i in indices]
+
+
+class LibraryIndex:
+    """
+    Client-side snapshot of the MPD database, which answers the
+    artist and album queries of the library view without asking the
+    server. The songs are kept with only the tags we use, and indexed
+    by artist, album artist, album and directory.
+
+    The snapshot is tied to the server's db_update stamp (from the
+    stats command) and persisted to disk, so it only needs to be
+    rebuilt when the database actually changed. The stamp is checked
+    on the first lookup after invalidate() is called.
+
+    An instance is not thread safe, it is meant to be used from a
+    single worker thread.
+    """
+
+    SongKeys = (
+        mpdmeta.FILE_KEY,
+        mpdmeta.ARTIST_KEY,
+        mpdmeta.ALBUMARTIST_KEY,
+        mpdmeta.ALBUM_KEY,
+        mpdmeta.DATE_KEY,
+        mpdmeta.TRACK_KEY,
+        mpdmeta.DISC_KEY,
+        mpdmeta.TITLE_KEY,
+        mpdmeta.DURATION_KEY
+    )
+
+    def __init__(self):
+        self._validated = False
+        self._db_update = None
+        self._songs = []
+        self._by_artist = {}
+        self._by_albumartist = {}
+        self._by_album = {}
+        self._by_directory = {}
+        self._sorted_files = []
+        self._sorted_order = array('l')
+        self._uri_table = None
+
+    def reset(self):
+        """Forgets the snapshot, e.g. when switching servers."""
+        self._validated = False
+        self._db_update = None
+        self._set_songs([])
+
+    def invalidate(self):
+        """
+        Makes the next lookup check whether the database changed. The
+        snapshot is only rebuilt if it did.
+        """
+        self._validated = False
+
+    def ensure_current(self, client, cache_file):
+        """
+        Brings the snapshot in line with the server's database, loading
+        it from the cache file or rebuilding it with the client if the
+        db_update stamp changed since it was taken.
+        """
+        if self._validated:
+            return
+        db_update = client.stats().get('db_update')
+        if db_update is None or db_update != self._db_update:
+            if not self._load(cache_file, db_update):
+                self._set_songs(LibraryIndex._fetch_songs(client))
+                self._db_update = db_update
+                self._save(cache_file)
+        self._validated = True
+
+    def find_artists(self, include_comps):
+        artists = set()
+        for name in self._by_albumartist:
+            artist = Artist.create({mpdmeta.ALBUMARTIST_KEY: name})
+            if artist:
+                artists.add(artist)
+        if include_comps:
+            for name in self._by_artist:
+                artist = Artist.create({mpdmeta.ARTIST_KEY: name})
+                if artist:
+                    artists.add(artist)
+        return sorted(list(artists))
+
+    def find_albums(self, artist):
+        albums = assemble_albums(
+            artist,
+            self._lookup(self._by_albumartist, artist.name),
+            self._lookup(self._by_artist, artist.name)
+        )
+        for album in albums:
+            mark_complete(album, self.songs_under_directory(album.dirpath))
+        return albums
+
+    def uri_table(self):
+        """
+        Returns a UriTable holding the URI of every song, which is
+        built on first use after each snapshot change.
+        """
+        if self._uri_table is None:
+            self._uri_table = UriTable(
+                song[mpdmeta.FILE_KEY] for song in self._songs
+            )
+        return self._uri_table
+
+    def songs_in_directory(self, directory):
+        return self._lookup(self._by_directory, directory)
+
+    def songs_under_directory(self, directory):
+        """
+        Returns the songs in the directory and in all of its
+        subdirectories, which is what MPD's base filter matches.
+        """
+        if not directory:
+            return list(self._songs)
+        # The files under the directory are the ones sorting between
+        # 'directory/' and 'directory0', as '0' follows '/'.
+        start = bisect.bisect_left(self._sorted_files, f'{directory}/')
+        end = bisect.bisect_left(self._sorted_files, f'{directory}0', start)
+        indices = sorted(self._sorted_order[start:end])
+        return [self._songs[i] for i in indices]
+
+    def songs_in_album(self, title):
+        return self._lookup(self._by_album, title)
+
+    @staticmethod
+    def _has_tag(song, tag, value):
+        tagvalue = song.get(tag)
+        if isinstance(tagvalue, list):
+            return value in tagvalue
+        return tagvalue == value
+
+    def _lookup(self, index, key):
+        return [self._songs[i] for i in index.get(key, [])]
+
+    def _set_songs(self, songs):
+        self._songs = songs
+        self._uri_table = None
+        self._by_artist = {}
+        self._by_albumartist = {}
+        self._by_album = {}
+        self._by_directory = {}
+        for i, song in enumerate(songs):
+            LibraryIndex._add(self._by_artist, song.get(mpdmeta.ARTIST_KEY), i)
+            LibraryIndex._add(
+                self._by_albumartist,
+                song.get(mpdmeta.ALBUMARTIST_KEY),
+                i
+            )
+            LibraryIndex._add(self._by_album, song.get(mpdmeta.ALBUM_KEY), i)
+            LibraryIndex._add(
+                self._by_directory,
+                os.path.dirname(song[mpdmeta.FILE_KEY]),
+                i
+            )
+        order = sorted(
+            range(len(songs)),
+            key=lambda i: songs[i][mpdmeta.FILE_KEY]
+        )
+        self._sorted_order = array('l', order)
+        self._sorted_files = [songs[i][mpdmeta.FILE_KEY] for i in order]
+
+    @staticmethod
+    def _add(index, tagvalue, i):
+        # Tags that occur more than once in a song come back as lists
+        values = tagvalue if isinstance(tagvalue, list) else [tagvalue]
+        for value in values:
+            if value is not None:
+                index.setdefault(value, []).append(i)
+
+    @staticmethod
+    def _fetch_songs(client):
+        # Listing the whole database at once can exceed the server's
+        # output buffer on large libraries, so go one top level
+        # directory at a time.
+        songs = []
+        for entry in client.lsinfo():
+            if mpdmeta.FILE_KEY in entry:
+                songs.append(LibraryIndex._compact(entry))
+            elif 'directory' in entry:
+                for record in client.listallinfo(entry['directory']):
+                    if mpdmeta.FILE_KEY in record:
+                        songs.append(LibraryIndex._compact(record))
+        return songs
+
+    @staticmethod
+    def _compact(record):
+        return {k: record[k] for k in LibraryIndex.SongKeys if k in record}
+
+    def _load(self, cache_file, db_update):
+        if db_update is None or not os.path.exists(cache_file):
+            return False
+        try:
+            with open(cache_file, 'r') as f:
+                snapshot = json.load(f)
+            if snapshot.get('db_update') != db_update:
+                return False
+            self._set_songs(snapshot['songs'])
+            self._db_update = db_update
+            return True
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f'Ignoring library cache {cache_file}: {e}')
+            return False
+
+    def _save(self, cache_file):
+        if self._db_update is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            tmp_file = f'{cache_file}.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump(
+                    {'db_update': self._db_update, 'songs': self._songs},
+                    f
+                )
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            logging.warning(f'Failed to save library cache {cache_file}: {e}')
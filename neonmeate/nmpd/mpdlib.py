@@ -2,119 +2,509 @@ import logging
 import os
 import random
 import re
+import socket
+import threading
+import time
 import mpd as mpd2
 
+from concurrent.futures import Future
+
 from gi.repository import GObject
 
 import neonmeate.util.thread as thread
 import neonmeate.util.metadata as mpdmeta
 
-from neonmeate.util.metadata import parse_date
-from ..model import Album, Artist, Song
+from neonmeate.util.config import neonmeate_cache_dir
+from ..ui.toolkit import glib_main
+from .library import LibraryIndex
 from functools import partial
 
 
 class MpdConnectionStatus(GObject.GObject):
+    """
+    The state of the link to the server, which is one of DISCONNECTED,
+    CONNECTING, CONNECTED or RECONNECTING. The state can be set from
+    any thread, but the signals are always emitted on the GTK main
+    thread. SIG_MPD_STATE is emitted on every state change, and
+    SIG_MPD_CONNECTED only when the link goes up or down.
+    """
+
     SIG_MPD_CONNECTED = 'mpd_connected'
+    SIG_MPD_STATE = 'mpd_state'
+
+    DISCONNECTED = 'disconnected'
+    CONNECTING = 'connecting'
+    CONNECTED = 'connected'
+    RECONNECTING = 'reconnecting'
 
     __gsignals__ = {
-        SIG_MPD_CONNECTED: (GObject.SignalFlags.RUN_FIRST, None, (bool,))
+        SIG_MPD_CONNECTED: (GObject.SignalFlags.RUN_FIRST, None, (bool,)),
+        SIG_MPD_STATE: (GObject.SignalFlags.RUN_FIRST, None, (str,))
     }
 
     def __init__(self):
         GObject.GObject.__init__(self)
-        self._connected = False
+        self._state = MpdConnectionStatus.DISCONNECTED
+
+    def set_state(self, state):
+        was_connected = self.is_connected()
+        self._state = state
+        connected = self.is_connected()
+        self._emit_state(state, connected, connected != was_connected)
 
-    def set_connected(self, connected):
-        self._connected = connected
-        self.emit(MpdConnectionStatus.SIG_MPD_CONNECTED, connected)
+    @glib_main
+    def _emit_state(self, state, connected, connected_changed):
+        self.emit(MpdConnectionStatus.SIG_MPD_STATE, state)
+        if connected_changed:
+            self.emit(MpdConnectionStatus.SIG_MPD_CONNECTED, connected)
+
+    def get_state(self):
+        return self._state
 
     def is_connected(self):
-        return self._connected
+        return self._state == MpdConnectionStatus.CONNECTED
+
+
+class PlayQueueDiff:
+    """
+    Describes how the play queue changed since the last sync. The
+    changes are (position, song) pairs in position order, where song
+    is the dictionary MPD returns for a queue entry. The queue now has
+    length entries, so anything at or beyond that is gone. When full
+    is True, the changes contain the entire queue.
+    """
+
+    def __init__(self, changes, length, full):
+        self.changes = changes
+        self.length = length
+        self.full = full
+
+
+class PlayQueueMirror:
+    """
+    Client-side copy of the play queue, which remembers the playlist
+    version it was last synced at. Syncing asks the server only for
+    the positions that changed since then (plchangesposid). Songs
+    already in the mirror are moved to their new positions locally,
+    so the tags are only fetched (plchanges) when an unknown song id
+    shows up. This keeps edits to large queues cheap.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._songs = []
+
+    def reset(self):
+        self._version = None
+        self._songs = []
+
+    def sync(self, client):
+        """
+        Brings the mirror up to date using the given client and
+        returns a PlayQueueDiff.
+        """
+        # The status is read in the same command list as the changes,
+        # so that the version and length describe the same queue.
+        if self._version is None:
+            status, songs = Mpd._run_batch(
+                client,
+                [('status',), ('playlistinfo',)]
+            )
+            self._songs = songs
+            self._version = status.get('playlist')
+            changes = list(enumerate(self._songs))
+            return PlayQueueDiff(changes, len(self._songs), True)
+
+        status, posids = Mpd._run_batch(
+            client,
+            [('status',), ('plchangesposid', self._version)]
+        )
+        version = status.get('playlist')
+        length = int(status.get('playlistlength', 0))
+
+        if version == self._version:
+            return PlayQueueDiff([], len(self._songs), False)
+
+        known = {song['id']: song for song in self._songs}
+        if any(p['id'] not in known for p in posids):
+            for song in client.plchanges(self._version):
+                known[song['id']] = song
+            if any(p['id'] not in known for p in posids):
+                # The queue changed again in between, and the new
+                # songs are gone already
+                self.reset()
+                return self.sync(client)
+
+        del self._songs[length:]
+        changes = []
+        for p in posids:
+            pos = int(p['cpos'])
+            song = dict(known[p['id']])
+            song['pos'] = p['cpos']
+            if pos < len(self._songs):
+                self._songs[pos] = song
+            else:
+                self._songs.append(song)
+            changes.append((pos, song))
+
+        self._version = version
+        return PlayQueueDiff(changes, length, False)
+
+
+class MpdConnectionPool:
+    """
+    A few connections to the server, each paired with a worker thread
+    of its own. Each pairing is a lane, and work submitted to a lane
+    only ever waits behind other work on the same lane:
+
+    STATUS: status and current song reads for the heartbeat
+    COMMAND: interactive commands like play, pause and queue edits
+    BROWSE: queue queries and other bulk reads
+    LIBRARY: the library index, which may first need a full snapshot
+    of the server's database
+
+    This way pausing never waits behind a large library query, and
+    the play queue does not wait for the library to be read.
+    """
+
+    STATUS = 'status'
+    COMMAND = 'command'
+    BROWSE = 'browse'
+    LIBRARY = 'library'
+    Lanes = (STATUS, COMMAND, BROWSE, LIBRARY)
+
+    @staticmethod
+    def new_client(timeout):
+        client = mpd2.MPDClient()
+        client.timeout = timeout
+        client.idletimeout = None
+        return client
+
+    def __init__(self, scheduled_executor, timeout):
+        self._clients = {}
+        self._event_loops = {}
+        for lane in MpdConnectionPool.Lanes:
+            self._clients[lane] = MpdConnectionPool.new_client(timeout)
+            self._event_loops[lane] = scheduled_executor.create_event_loop(
+                f'Mpd-{lane}'
+            )
+
+    def connect(self, host, port, timeout):
+        """
+        Connects every lane, giving up on each connection attempt after
+        timeout seconds. Each client is connected on its own lane's
+        worker, as the clients are not thread safe, and this waits for
+        all of them. If any of them fails, the lanes are disconnected
+        again and the error is raised.
+        """
+
+        def connect_client(client):
+            command_timeout = client.timeout
+            client.timeout = timeout
+            try:
+                client.connect(host, port)
+            finally:
+                client.timeout = command_timeout
+
+        waiting = [self._run_on_lane(lane, connect_client)
+                   for lane in MpdConnectionPool.Lanes]
+        errors = [f.exception() for f in waiting if f.exception()]
+        if errors:
+            self.disconnect()
+            raise errors[0]
+
+    def disconnect(self):
+        """
+        Disconnects every lane on its own worker, after the work that
+        is already queued on it. This does not wait, but anything
+        submitted to a lane afterwards runs after its disconnect.
+        """
+
+        def disconnect_client(client):
+            try:
+                client.disconnect()
+            except (mpd2.MPDError, OSError):
+                pass
+
+        for lane in MpdConnectionPool.Lanes:
+            self._run_on_lane(lane, disconnect_client)
+
+    def _run_on_lane(self, lane, action):
+        """
+        Runs action(client) on the worker of the lane, right away if
+        that is the calling thread. Returns a Future for the result.
+        """
+        result = Future()
+
+        def run(client):
+            try:
+                result.set_result(action(client))
+            except BaseException as e:
+                result.set_exception(e)
+
+        if threading.current_thread() is self._event_loops[lane]:
+            run(self._clients[lane])
+        else:
+            self.execute(lane, run)
+        return result
+
+    def client(self, lane):
+        return self._clients[lane]
+
+    def execute(self, lane, task):
+        """Runs task(client) on the worker thread of the lane."""
+        self._event_loops[lane].add(partial(task, self._clients[lane]))
 
 
 class Mpd:
     """
     Our client for interacting with the MPD server. The commands are
     asynchronously executed and methods typically accept a callback to
-    accept the results of a command. The executor provided to the
-    constructor will be used to issue commands to the server.
+    accept the results of a command. Commands are issued through a
+    MpdConnectionPool whose worker threads are created with the
+    executor provided to the constructor.
 
     """
 
-    def __init__(self, scheduled_executor, configstate, connstatus):
+    Timeout = 10
+    ConnectTimeout = 5
+
+    # After losing the connection, reconnect attempts are made after
+    # delays that double from ReconnectDelay up to ReconnectMaxDelay.
+    ReconnectDelay = 0.5
+    ReconnectMaxDelay = 30
+
+    # Upper bound on the commands sent in a single command list, so
+    # that the server's output buffer is not exceeded.
+    CommandListSize = 256
+
+    def __init__(self, scheduled_executor, configstate, connstatus,
+                 async_client=None):
+        """
+        If an AsyncMpd is given as async_client, artist and album
+        queries are answered by it rather than by the library index.
+        """
         self._exec = scheduled_executor
+        self._aio = async_client
         host, port = configstate.get_host_and_port()
         self._configstate = configstate
         self._configstate.connect('notify::host-and-port', self._on_host_chg)
         self._connstatus = connstatus
         self._host = host
         self._port = port
-        self._client = mpd2.MPDClient()
-        self._client.timeout = 10
-        self._client.idletimeout = None
+        self._pool = MpdConnectionPool(scheduled_executor, Mpd.Timeout)
         self._status = {}
         self._outputs = []
+        self._queue = PlayQueueMirror()
+        self._library = LibraryIndex()
+        self._link_lock = threading.Lock()
+        self._should_connect = False
+        self._pending = {}
+        self._reconnect_task = thread.NullCancelable()
 
     def _on_host_chg(self, state, _):
         self.disconnect()
+        self.exec(lambda client: self._library.reset(),
+                  MpdConnectionPool.LIBRARY)
         self._host, self._port = self._configstate.get_host_and_port()
+        if self._aio is not None:
+            self._aio.set_host(self._host, self._port)
         self.connect()
 
+    def invalidate_library(self):
+        """
+        Called when the server's database may have changed, so that the
+        library index checks it again before answering the next query.
+        """
+        self._library.invalidate()
+
+    def _current_library(self, client):
+        """
+        Returns the library index, brought up to date with the server.
+        Must be called on the LIBRARY lane.
+        """
+        server = re.sub(r'[^\w.-]', '_', f'{self._host}-{self._port}')
+        cache_file = os.path.join(
+            neonmeate_cache_dir(),
+            f'library-{server}.json'
+        )
+        self._library.ensure_current(client, cache_file)
+        return self._library
+
     def set_host(self, host):
         self._host = host
 
     def set_port(self, port):
         self._port = port
 
-    def exec(self, runnable):
-        self._exec.execute(runnable)
+    def exec(self, task, lane=MpdConnectionPool.COMMAND, replay_key=None):
+        """
+        Runs task(client) on the worker thread of the given lane.
+
+        If the connection is lost, tasks with a replay_key are held and
+        run again once it is back. Only the latest task for each key
+        is kept, so this is meant for idempotent tasks like reads and
+        setting the volume. Other tasks are dropped.
+        """
+        if replay_key is not None and self._hold(replay_key, task, lane):
+            return
+
+        def run(client):
+            try:
+                task(client)
+            except (mpd2.ConnectionError, OSError) as e:
+                if not self._on_link_lost(e):
+                    raise
+                held = replay_key is not None and \
+                    self._hold(replay_key, task, lane)
+                if not held:
+                    logging.warning(f'Dropped a command to MPD: {e}')
+
+        self._pool.execute(lane, run)
+
+    def _is_offline(self):
+        """
+        True if there is no connection and none is being made. Queries
+        answer with empty results right away then, while during a
+        (re)connect they are held until the link is up instead.
+        """
+        with self._link_lock:
+            return not self._should_connect
+
+    def _hold(self, replay_key, task, lane):
+        with self._link_lock:
+            if not self._should_connect or self._connstatus.is_connected():
+                return False
+            self._pending[replay_key] = (task, lane)
+            return True
 
     def connect(self):
         """
-        Connects to the MPD server, blocking until the server
-        status is obtained.
+        Starts connecting to the MPD server in the background, and
+        returns immediately. Progress is reported through the
+        MpdConnectionStatus.
         """
-        try:
-            self._client.connect(self._host, self._port)
-            self._connstatus.set_connected(True)
-            self._outputs = self._client.outputs()
-        except ConnectionError:
-            logging.error('connection refused')
-            self._connstatus.set_connected(False)
+        with self._link_lock:
+            if self._should_connect:
+                return
+            self._should_connect = True
+            self._connstatus.set_state(MpdConnectionStatus.CONNECTING)
+        self._pool.execute(MpdConnectionPool.COMMAND, self._establish)
+
+    def _establish(self, client):
+        if self._open_link():
+            self._replay()
             return
+        with self._link_lock:
+            if self._should_connect:
+                self._should_connect = False
+                self._connstatus.set_state(MpdConnectionStatus.DISCONNECTED)
+
+    def _open_link(self):
+        """
+        Connects all lanes, called on the COMMAND lane. Returns True if
+        the connection is up and still wanted.
+        """
+        if not self._should_connect:
+            return False
+        try:
+            self._pool.connect(self._host, self._port, Mpd.ConnectTimeout)
+            command_client = self._pool.client(MpdConnectionPool.COMMAND)
+            self._outputs = command_client.outputs()
+        except (mpd2.MPDError, OSError) as e:
+            logging.error(f'Connecting to {self._host}:{self._port}: {e}')
+            return False
+        with self._link_lock:
+            if not self._should_connect:
+                self._pool.disconnect()
+                return False
+            self._connstatus.set_state(MpdConnectionStatus.CONNECTED)
+        return True
+
+    def _on_link_lost(self, e):
+        """
+        Starts reconnecting, unless the connection was closed on
+        purpose. Returns False in that case.
+        """
+        with self._link_lock:
+            if not self._should_connect:
+                return False
+            if not self._connstatus.is_connected():
+                return True
+            self._connstatus.set_state(MpdConnectionStatus.RECONNECTING)
+        logging.warning(f'Lost the connection to MPD: {e}')
+        self._queue.reset()
+        self._schedule_reconnect(0)
+        return True
+
+    def _schedule_reconnect(self, attempt):
+        delay = min(Mpd.ReconnectMaxDelay, Mpd.ReconnectDelay * 2 ** attempt)
+
+        def reconnect(client):
+            if not self._should_connect:
+                return
+            self._pool.disconnect()
+            if self._open_link():
+                self._replay()
+            else:
+                self._schedule_reconnect(attempt + 1)
+
+        def on_delay():
+            self._pool.execute(MpdConnectionPool.COMMAND, reconnect)
+
+        with self._link_lock:
+            if self._should_connect:
+                self._reconnect_task = self._exec.schedule(delay, on_delay)
 
-        def set_status(s):
-            self._status = s
+    def _replay(self):
+        with self._link_lock:
+            pending, self._pending = self._pending, {}
+        for replay_key, (task, lane) in pending.items():
+            self.exec(task, lane, replay_key)
 
-        self.status(set_status)
+    def open_connection(self):
+        """
+        Opens a new connection to the current server, separate from
+        the ones used for commands. The caller owns the returned client
+        and is responsible for disconnecting it.
+        """
+        client = MpdConnectionPool.new_client(Mpd.ConnectTimeout)
+        client.connect(self._host, self._port)
+        client.timeout = Mpd.Timeout
+        return client
 
     def disconnect(self):
-        self._client.disconnect()
-        self._connstatus.set_connected(False)
+        with self._link_lock:
+            self._should_connect = False
+            self._pending = {}
+            self._reconnect_task.cancel()
+        self._pool.disconnect()
+        if self._aio is not None:
+            self._aio.disconnect()
+        self._queue.reset()
+        self._connstatus.set_state(MpdConnectionStatus.DISCONNECTED)
 
     def close(self):
         """Shuts down the client and disconnects from the server."""
-        self._client.close()
         self.disconnect()
 
     def get_outputs(self):
         return self._outputs
 
     def enable_output(self, id, enabled):
-        def task():
+        def task(client):
             if enabled:
-                self._client.enableoutput(id)
+                client.enableoutput(id)
             else:
-                self._client.disableoutput(id)
+                client.disableoutput(id)
 
-        self.exec(task)
+        self.exec(task, replay_key=f'output:{id}')
 
     def set_volume(self, value):
-        def task():
-            self._client.setvol(value)
+        def task(client):
+            client.setvol(value)
 
-        self.exec(task)
+        self.exec(task, replay_key='volume')
 
     def toggle_play_mode(self, name, active):
         """
@@ -124,20 +514,22 @@ class Mpd:
         :param active: True enables and False disables the mode.
         """
         state = 1 if active else 0
-        fn = getattr(self._client, name)
-        runnable = partial(fn, state)
-        self.exec(runnable)
+
+        def task(client):
+            getattr(client, name)(state)
+
+        self.exec(task, replay_key=f'mode:{name}')
 
     def currentsong(self, callback):
         """Fetches the current song."""
 
-        def task():
-            record = self._client.currentsong()
+        def task(client):
+            record = client.currentsong()
             while isinstance(record.get('file', []), list):
-                record = self._client.currentsong()
+                record = client.currentsong()
             callback(record)
 
-        self.exec(task)
+        self.exec(task, MpdConnectionPool.STATUS, 'currentsong')
 
     def playlistinfo(self, callback):
         """
@@ -145,103 +537,87 @@ class Mpd:
         song's tags. A list of dictionaries, one per song,
         will be passed to the callback.
         """
-        if not self._connstatus.is_connected():
+        if self._is_offline():
             callback([])
             return
 
-        def task():
-            playqueue = self._client.playlistinfo()
+        def task(client):
+            playqueue = client.playlistinfo()
             callback(playqueue)
 
-        self.exec(task)
+        self.exec(task, MpdConnectionPool.BROWSE, 'playlistinfo')
+
+    def playlist_changes(self, callback):
+        """
+        Syncs the play queue mirror with the server and passes a
+        PlayQueueDiff, holding only the entries that changed since
+        the previous call, to the callback.
+        """
+        if self._is_offline():
+            callback(PlayQueueDiff([], 0, True))
+            return
+
+        def task(client):
+            callback(self._queue.sync(client))
+
+        self.exec(task, MpdConnectionPool.BROWSE, 'playlist_changes')
 
     def stop_playing(self):
-        self.exec(self._client.stop)
+        self.exec(lambda client: client.stop())
 
     def next_song(self):
-        self.exec(self._client.next)
+        self.exec(lambda client: client.next())
 
     def prev_song(self):
-        self.exec(self._client.previous)
+        self.exec(lambda client: client.previous())
 
     def toggle_pause(self, should_pause):
-        def on_status(mpdstatus):
+        def task(client):
             if should_pause:
-                task = partial(self._client.pause, 1)
+                client.pause(1)
+            elif 'pause' == client.status().get('state', 'stop'):
+                client.pause(0)
             else:
-                task = partial(self._client.play, 0)
-                if 'pause' == mpdstatus.get('state', 'stop'):
-                    task = partial(self._client.pause, 0)
-            self.exec(task)
+                client.play(0)
 
-        self.status(on_status)
+        self.exec(task)
 
     def find_artists(self, callback, include_comps):
         """
         Queries the database for all artists. A list of Artist
         instances will be provided to the callback.
         """
-        if not self._connstatus.is_connected():
+        if self._is_offline():
             callback([])
             return
 
-        def task():
-            artists = set()
-            for a in self._client.list('albumartist'):
-                artist = Artist.create(a)
-                if artist:
-                    artists.add(artist)
-            if include_comps:
-                for a in self._client.list('artist'):
-                    artist = Artist.create(a)
-                    if artist:
-                        artists.add(artist)
+        if self._aio is not None:
+            self._aio.submit(self._aio.find_artists(include_comps), callback)
+            return
 
-            callback(sorted(list(artists)))
+        def task(client):
+            library = self._current_library(client)
+            callback(library.find_artists(include_comps))
 
-        self.exec(task)
+        self.exec(task, MpdConnectionPool.LIBRARY, 'artists')
 
     def find_albums(self, artist, callback):
-        def task():
-            songs_by_album = {}
-            dirs_by_album = {}
-            songs = set()
-            Mpd._process_songs(
-                self._client.find('albumartist', artist.name),
-                songs_by_album, dirs_by_album, songs
-            )
-
-            Mpd._process_songs(
-                self._client.find('artist', artist.name),
-                songs_by_album, dirs_by_album, songs
-            )
-
-            albums = []
-
-            for key, songs in songs_by_album.items():
-                a = Album(artist, key[0], key[1], songs, dirs_by_album[key][0])
-                albums.append(a)
-
-            ordered_albums = Album.sorted_chrono(albums)
-            callback(ordered_albums)
+        """
+        Finds the albums the artist appears on, passing a list of Album
+        instances in chronological order to the callback.
+        """
+        if self._aio is not None:
+            if self._is_offline():
+                callback([])
+            else:
+                self._aio.submit(self._aio.find_albums(artist), callback)
+            return
 
-        self.exec(task)
+        def task(client):
+            library = self._current_library(client)
+            callback(library.find_albums(artist))
 
-    @staticmethod
-    def _process_songs(songs, songs_by_album, dirs_by_album, songset):
-        for song in songs:
-            if mpdmeta.ALBUM_KEY in song:
-                album_name = song[mpdmeta.ALBUM_KEY]
-                date = parse_date(song.get(mpdmeta.DATE_KEY))
-                directory = os.path.dirname(song[mpdmeta.FILE_KEY])
-                key = (album_name, date, directory)
-                songlist = songs_by_album.setdefault(key, [])
-                dirs = dirs_by_album.setdefault(key, [])
-                dirs.append(directory)
-                s = Song.create(song)
-                if s not in songset:
-                    songlist.append(s)
-                    songset.add(s)
+        self.exec(task, MpdConnectionPool.LIBRARY, f'albums:{artist}')
 
     def add_random(self, item_type, n):
         if item_type == 'Songs':
@@ -252,10 +628,10 @@ class Mpd:
             self._add_random_albums(n)
 
     def _add_random_albums(self, n):
-        def task():
+        def task(client):
             pairs = []
             for rec in [r for r in
-                        self._client.list(
+                        client.list(
                             mpdmeta.ALBUM_KEY,
                             'group',
                             mpdmeta.ALBUMARTIST_KEY
@@ -268,28 +644,23 @@ class Mpd:
                         pairs.append((art, i))
                 else:
                     pairs.append((art, alb))
-            all_files = []
             selected = random.choices(pairs, k=n)
-            for artist, album in selected:
-                files = [r[mpdmeta.FILE_KEY] for r in
-                         self._client.list(
-                             mpdmeta.FILE_KEY,
-                             mpdmeta.ALBUMARTIST_KEY,
-                             artist,
-                             mpdmeta.ALBUM_KEY,
-                             album
-                         )]
-                all_files.extend(files)
-            self.add_files_to_playlist(all_files)
+            self.batch([
+                ('findadd', Mpd._and_filter(
+                    Mpd._tag_filter(mpdmeta.ALBUMARTIST_KEY, artist),
+                    Mpd._tag_filter(mpdmeta.ALBUM_KEY, album)
+                ))
+                for artist, album in selected
+            ])
 
-        self.exec(task)
+        self.exec(task, MpdConnectionPool.BROWSE)
 
     def _add_random_artists(self, n):
-        def task():
+        def task(client):
             artists = set([])
 
             def add_all(keyname):
-                for record in self._client.list(keyname):
+                for record in client.list(keyname):
                     aa = record.get(keyname, '')
                     if aa != '':
                         artists.add(aa)
@@ -298,27 +669,19 @@ class Mpd:
             add_all(mpdmeta.ARTIST_KEY)
             l = list(artists)
             selected = random.choices(l, k=n)
-            files = []
-            for sel in selected:
-                files.extend([r[mpdmeta.FILE_KEY] for r in
-                              self._client.list(
-                                  mpdmeta.FILE_KEY,
-                                  mpdmeta.ARTIST_KEY,
-                                  sel
-                              )])
-            self.add_files_to_playlist(files)
+            self.batch([
+                ('findadd', Mpd._tag_filter(mpdmeta.ARTIST_KEY, sel))
+                for sel in selected
+            ])
 
-        self.exec(task)
+        self.exec(task, MpdConnectionPool.BROWSE)
 
     def _add_random_songs(self, count):
-        key = mpdmeta.FILE_KEY
+        def task(client):
+            uris = self._current_library(client).uri_table()
+            self.add_files_to_playlist(uris.sample(random, count))
 
-        def task():
-            allsongs = [r for r in self._client.listall() if key in r]
-            selected = [r[key] for r in random.choices(allsongs, k=count)]
-            self.add_files_to_playlist(selected)
-
-        self.exec(task)
+        self.exec(task, MpdConnectionPool.LIBRARY)
 
     def add_songs(self, songs):
         files = [song.file for song in songs]
@@ -332,73 +695,134 @@ class Mpd:
         Appends an album to the queue.
         :param album: an Album instance containing the songs to add.
         """
-        files = [song.file for song in album.sorted_songs()]
-        self.add_files_to_playlist(files)
+        if album.complete:
+            self.batch([('findadd', Mpd._and_filter(
+                Mpd._base_filter(album.dirpath),
+                Mpd._tag_filter(mpdmeta.ALBUM_KEY, album.title)
+            ))])
+        else:
+            files = [song.file for song in album.sorted_songs()]
+            self.add_files_to_playlist(files)
 
-    def add_files_to_playlist(self, files):
-        def task():
-            for file in files:
-                self._client.add(file)
+    @staticmethod
+    def _quoted(value):
+        """Quotes a value for use in a filter expression."""
+        escaped = value.replace('\\', '\\\\').replace('"', '\\"')
+        return f'"{escaped}"'
 
-        self.exec(task)
+    @staticmethod
+    def _tag_filter(tag, value):
+        return f'({tag} == {Mpd._quoted(value)})'
+
+    @staticmethod
+    def _base_filter(directory):
+        return f'(base {Mpd._quoted(directory)})'
+
+    @staticmethod
+    def _and_filter(*expressions):
+        return f'({" AND ".join(expressions)})'
+
+    def add_files_to_playlist(self, files):
+        self.batch([('add', file) for file in files])
 
     def remove_album_from_playlist(self, album):
         files = set(s.file for s in album.sorted_songs())
         self.remove_files_from_playlist(files)
 
     def remove_files_from_playlist(self, files):
+        def task(client):
+            found = self._run_batch(client, [
+                ('playlistfind', mpdmeta.FILE_KEY, file) for file in files
+            ])
+            self._run_batch(client, [
+                ('deleteid', entry['id'])
+                for entries in found
+                for entry in entries
+            ])
+
+        self.exec(task)
+
+    def batch(self, commands, callback=None,
+              lane=MpdConnectionPool.COMMAND):
+        """
+        Sends several commands to the server using command lists, so
+        that they are pipelined instead of each waiting for a round
+        trip. The results, one per command, are passed to the callback
+        if one is given.
+
+        :param commands: a sequence of tuples, each holding the name of
+        a client method followed by its arguments, e.g. ('add', file).
+        :param callback: optional function accepting the result list.
+        :param lane: the MpdConnectionPool lane to send the commands on.
+        """
+        commands = list(commands)
+        if not commands:
+            if callback is not None:
+                callback([])
+            return
 
-        def removal_task(playlist):
-            for t in playlist:
-                if t[mpdmeta.FILE_KEY] in files:
-                    self._client.deleteid(t['id'])
+        def task(client):
+            results = self._run_batch(client, commands)
+            if callback is not None:
+                callback(results)
 
-        def on_playlist(playlist):
-            self.exec(removal_task(playlist))
+        self.exec(task, lane)
 
-        self.playlistinfo(on_playlist)
+    @staticmethod
+    def _run_batch(client, commands):
+        """
+        Executes the commands with the client on the calling thread,
+        in command lists of at most CommandListSize commands each.
+        """
+        results = []
+        size = Mpd.CommandListSize
+        for i in range(0, len(commands), size):
+            client.command_list_ok_begin()
+            for name, *args in commands[i:i + size]:
+                getattr(client, name)(*args)
+            results.extend(client.command_list_end())
+        return results
 
     def status(self, callback):
-        if not self._connstatus.is_connected():
+        if self._is_offline():
             callback({})
             return
 
-        def task():
-            callback(self._client.status())
+        def task(client):
+            callback(client.status())
 
-        self.exec(task)
+        self.exec(task, MpdConnectionPool.STATUS, 'status')
 
     def clear_playlist(self):
-        def task():
-            self._client.clear()
+        def task(client):
+            client.clear()
 
         self.exec(task)
 
     def crop_playlist(self):
-        def task():
-            q = self._client.playlistinfo()
-            n = len(q)
+        def task(client):
+            n = int(client.status().get('playlistlength', 0))
             if n > 1:
-                self._client.delete((1, n))
+                client.delete((1, n))
 
         self.exec(task)
 
     def shuffle_playlist(self):
-        def task():
-            self._client.shuffle()
+        def task(client):
+            client.shuffle()
 
         self.exec(task)
 
     def delete_playlist_item(self, index):
-        def task():
-            self._client.delete(index)
+        def task(client):
+            client.delete(index)
 
         self.exec(task)
 
     def update(self):
         if self._connstatus.is_connected():
-            def task():
-                self._client.update()
+            def task(client):
+                client.update()
 
             self.exec(task)
 
@@ -472,15 +896,112 @@ class MpdState(GObject.GObject):
             self._update_if_changed('elapsedseconds', elapsed_secs)
 
 
+class PlaybackClock:
+    """
+    Local model of the playback position, so that the elapsed time can
+    be shown between status updates. It is synced from each status and
+    advances with the monotonic clock while a song is playing.
+    """
+
+    def __init__(self):
+        self._elapsed = 0.0
+        self._synced_at = time.monotonic()
+        self._playing = False
+
+    def sync(self, elapsed, playing):
+        self._elapsed = elapsed
+        self._synced_at = time.monotonic()
+        self._playing = playing
+
+    def elapsed(self):
+        if self._playing:
+            return self._elapsed + time.monotonic() - self._synced_at
+        return self._elapsed
+
+
+class MpdIdler(threading.Thread):
+    """
+    Keeps a dedicated connection parked in MPD's idle command. Each
+    time the server reports that subsystems have changed, on_changes
+    is called (on this thread) with the list of subsystem names. If
+    the connection cannot be established or idle fails, on_failure
+    is called with the exception and the thread exits.
+    """
+
+    Subsystems = (
+        'player',
+        'playlist',
+        'mixer',
+        'options',
+        'database',
+        'update',
+        'output'
+    )
+
+    def __init__(self, connection_factory, on_changes, on_failure):
+        super(MpdIdler, self).__init__(name='MpdIdle', daemon=True)
+        self._connection_factory = connection_factory
+        self._on_changes = on_changes
+        self._on_failure = on_failure
+        self._running = False
+        self._fileno = None
+
+    def run(self):
+        self._running = True
+        try:
+            client = self._connection_factory()
+        except (mpd2.MPDError, OSError) as e:
+            self._running = False
+            self._on_failure(e)
+            return
+        try:
+            self._fileno = client.fileno()
+            while self._running:
+                changes = client.idle(*MpdIdler.Subsystems)
+                if changes and self._running:
+                    self._on_changes(changes)
+        except (mpd2.MPDError, OSError) as e:
+            if self._running:
+                self._on_failure(e)
+        finally:
+            self._running = False
+            self._fileno = None
+            try:
+                client.disconnect()
+            except (mpd2.MPDError, OSError):
+                pass
+
+    def stop(self):
+        """
+        Wakes the thread out of idle by shutting down its socket, so
+        that it does not linger until the next server event.
+        """
+        self._running = False
+        fileno = self._fileno
+        if fileno is None:
+            return
+        try:
+            with socket.socket(fileno=os.dup(fileno)) as sock:
+                sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
 class MpdHeartbeat(GObject.GObject):
     """
-    Ideally MPD would allow a client to register itself to receive
-    status pushes, so that a client can update in a reactive way as
-    needed. MPD currently does not support that kind of model; the
-    idle command is sort of in that vein, but isn't all that useful.
-    So instead we create a heartbeat with the server that polls on an
+    Tracks the player state and emits signals when it changes. By
+    default a dedicated connection is parked in MPD's idle command
+    (see MpdIdler), and the status is only re-read when the server
+    reports a change. While a song is playing, the status is also
+    polled on an interval to correct for drift. If idle is disabled
+    or fails, the heartbeat falls back to polling the status on every
     interval.
 
+    Between status updates, the elapsed time of a playing song is
+    advanced with a PlaybackClock and emitted every TickInterval
+    seconds, so that the interval can be several seconds long without
+    the progress display stalling.
+
     The only needed interaction with an instance of the heartbeat is
     to call connect() to receive event notification. It also will need
     to be started and stopped.
@@ -496,6 +1017,8 @@ class MpdHeartbeat(GObject.GObject):
     SIG_UPDATING_DB = 'updatingdb'
     SIG_VOL_CHANGE = 'volume-changed'
 
+    TickInterval = 0.25
+
     __gsignals__ = {
         SIG_PLAYLIST_CHANGED: (GObject.SignalFlags.RUN_FIRST, None, ()),
         SIG_SONG_ELAPSED: (GObject.SignalFlags.RUN_FIRST, None, (float, float)),
@@ -509,11 +1032,14 @@ class MpdHeartbeat(GObject.GObject):
         SIG_VOL_CHANGE: (GObject.SignalFlags.RUN_FIRST, None, (float,))
     }
 
-    def __init__(self, client, millis_interval, executor, connstatus):
+    def __init__(self, client, millis_interval, executor, connstatus,
+                 use_idle=True):
         """
         The executor will be used to periodically query the server.
         """
         GObject.GObject.__init__(self)
+        self._use_idle = use_idle
+        self._idler = None
         self._connstatus = connstatus
         self.logger = logging.getLogger(__name__)
         self._client = client
@@ -521,6 +1047,7 @@ class MpdHeartbeat(GObject.GObject):
         self._delay = millis_interval / 1000.0
         self._mpd_status = {}
         self._state = MpdState()
+        self._clock = PlaybackClock()
         for prop, fn in {
             'songid': self._on_song_change,
             'playlist': self._on_playlist_change,
@@ -537,26 +1064,55 @@ class MpdHeartbeat(GObject.GObject):
         }.items():
             self._state.connect(f'notify::{prop}', fn)
         self._scheduled_hb = None
-        self._connstatus.connect('mpd_connected', self._on_connect)
+        self._scheduled_tick = None
+        self._connstatus.connect(
+            MpdConnectionStatus.SIG_MPD_STATE,
+            self._on_connection_state
+        )
 
-    def _on_connect(self, statusobj, connected):
-        if connected:
+    def _on_connection_state(self, statusobj, state):
+        # While reconnecting, the heartbeat keeps running and the state
+        # is kept, so that the views are not emptied. The status reads
+        # are held by the client until the link is back.
+        if state == MpdConnectionStatus.CONNECTED:
             self.start()
-        else:
+        elif state == MpdConnectionStatus.RECONNECTING:
+            self._clock.sync(self._clock.elapsed(), False)
+        elif state == MpdConnectionStatus.DISCONNECTED:
             self.stop()
 
     def start(self):
+        if self._use_idle and self._idler is None:
+            self._idler = MpdIdler(
+                self._client.open_connection,
+                self._on_idle_changes,
+                self._on_idle_failure
+            )
+            self._idler.start()
+            self._thread.execute(self._refresh_status)
         if self._scheduled_hb is None:
             self._scheduled_hb = self._thread.schedule_periodic(
                 self._delay,
                 self._on_hb_interval
             )
+        if self._scheduled_tick is None:
+            self._scheduled_tick = self._thread.schedule_periodic(
+                MpdHeartbeat.TickInterval,
+                self._on_tick
+            )
 
     def stop(self):
         self._state.reset()
+        if self._idler:
+            self._idler.stop()
+            self._idler = None
         if self._scheduled_hb:
             self._scheduled_hb.cancel()
             self._scheduled_hb = None
+        if self._scheduled_tick:
+            self._scheduled_tick.cancel()
+            self._scheduled_tick = None
+        self._clock.sync(0.0, False)
 
     def connect(self, signal_name, handler, *args):
         """
@@ -571,18 +1127,45 @@ class MpdHeartbeat(GObject.GObject):
             *args
         )
 
+    def _on_idle_changes(self, subsystems):
+        self.logger.debug(f'idle: {subsystems}')
+        if 'database' in subsystems:
+            self._client.invalidate_library()
+        self._thread.execute(self._refresh_status)
+
+    def _on_idle_failure(self, e):
+        self.logger.warning(f'idle failed, falling back to polling: {e}')
+        self._idler = None
+
+    def _on_tick(self):
+        if self._state.get_property('state') == 'play':
+            total = self._state.get_property('songseconds')
+            elapsed = min(self._clock.elapsed(), total)
+            self.emit(MpdHeartbeat.SIG_SONG_ELAPSED, elapsed, total)
+        return True
+
     def _on_hb_interval(self):
+        # When idling, the server tells us about changes, so we only
+        # need to poll to keep the clock of a playing song in sync.
+        if self._idler is None or self._state.get_property('state') == 'play':
+            self._refresh_status()
+        return True
+
+    def _refresh_status(self):
         def on_status(status):
             self._mpd_status = status
             self._state.update(self._mpd_status)
+            self._clock.sync(
+                float(status.get('elapsed', 0)),
+                self._is_playing()
+            )
 
-        # Not strictly needed since the hb is typically created
-        # with the same thread that is passed to the mpd client.
+        # The status arrives on the status lane of the client, so the
+        # state update is handed back to the heartbeat's thread.
         def on_hb_thread(status):
             self._thread.execute(partial(on_status, status))
 
         self._client.status(on_hb_thread)
-        return True
 
     def _on_state_change(self, obj, spec):
         self.emit(
@@ -624,6 +1207,8 @@ class MpdHeartbeat(GObject.GObject):
 
     def _on_updating(self, obj, spec):
         propval = self._state.get_property(spec.name)
+        if propval == '0':
+            self._client.invalidate_library()
         self.emit(MpdHeartbeat.SIG_UPDATING_DB, propval != '0')
 
     def _on_mode_change(self, obj, spec):
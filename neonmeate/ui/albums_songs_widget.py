@@ -58,7 +58,8 @@ class AlbumsAndSongs(Gtk.Box):
         self._artist_by_name = {a.name: a for a in artists}
 
     def reload(self):
-        pass
+        # Covers may have been replaced along with the music
+        self._albums.on_covers_changed()
 
     def on_artist_selected(self, artist_name):
         if not artist_name or artist_name == self._selected_artist:
@@ -1,12 +1,23 @@
 from gi.repository import Gtk, GObject, GLib, Pango, Gdk
 
 from neonmeate.ui.songs_menu_widget import SongsMenu
-from neonmeate.ui.toolkit import add_pixbuf_border, AlbumArt, scale_pixbuf
+from neonmeate.ui.toolkit import add_pixbuf_border, AlbumArt, scale_pixbuf, \
+    bordered_surface
 
 
 class Albums(Gtk.ScrolledWindow):
     SIG_ALBUM_SELECTED = 'album_selected'
 
+    # Art requests for albums more than this many screenfuls away
+    # from the visible ones are cancelled.
+    ArtKeepScreens = 2
+
+    # Art is requested ahead of drawing for the visible albums first,
+    # then for this many screenfuls below and above them, with at most
+    # PrefetchConcurrency requests in flight.
+    PrefetchScreens = 1
+    PrefetchConcurrency = 4
+
     __gsignals__ = {
         SIG_ALBUM_SELECTED: (GObject.SignalFlags.RUN_FIRST, None, (int,))
     }
@@ -27,10 +38,13 @@ class Albums(Gtk.ScrolledWindow):
         self._mpdclient = mpdclient
         self._border_color = border_style_context.get_background_color(0)
         self._model = Gtk.ListStore(GObject.TYPE_PYOBJECT)
-        self._surface_cache = {}
+        self._surfaces = art_cache.surface_cache()
+        self._prefetch_queued = False
+        self._fetching = set()
         self._view = self._build_view()
         self.add(self._view)
         self.connect('notify::scale-factor', self._on_scale)
+        self.get_vadjustment().connect('value-changed', self._on_scroll)
         self._selected_artist = None
         self._selected_album = None
         self._artists = []
@@ -75,35 +89,129 @@ class Albums(Gtk.ScrolledWindow):
 
     def _render_cover(self, view, cell, model, iter, placeholder_pb):
         album = model[iter][0]
-        surface = self._surface_cache.get(album, self._placeholder_surface)
-        if surface != self._placeholder_surface:
+        border_color = self._get_border_color()
+        key = self._surface_key(album, border_color)
+        surface = self._surfaces.get(key)
+        if surface is not None:
             cell.set_property('surface', surface)
             return
-        if album.art is None:
-            album.art = AlbumArt(self._art, album, placeholder_pb)
-            row = Gtk.TreeRowReference.new(model, model.get_path(iter))
-
-            def on_art_ready(ready_pb, _):
-                path = row.get_path()
-                if path:
-                    model.row_changed(path, model.get_iter(path))
-                self.queue_draw()
-
-            album.art.resolve(on_art_ready, None)
-        elif album.art.is_resolved():
-            pb = add_pixbuf_border(
-                album.art.get_scaled_pixbuf(self._album_width()),
-                self._get_border_color(),
+        art = self._album_art(album)
+        if not art.is_resolved():
+            if art.needs_resolving():
+                self._queue_prefetch()
+            surface = self._placeholder_surface
+        else:
+            surface = bordered_surface(
+                art.get_tile(),
+                border_color,
+                self.get_scale_factor(),
                 border_width=self._options.border_width
             )
-            surface = self.pixbuf_surface(pb)
-            self._surface_cache[album] = surface
+            self._surfaces[key] = surface
         cell.set_property('surface', surface)
 
+    def _surface_key(self, album, border_color):
+        return (
+            album.dirpath,
+            self._album_width(),
+            self.get_scale_factor(),
+            border_color.to_string(),
+            self._options.border_width
+        )
+
+    def _album_art(self, album):
+        """
+        Returns the AlbumArt of the album at the current album width,
+        replacing one made for another width.
+        """
+        if album.art is None or album.art.edge_size != self._album_width():
+            if album.art is not None:
+                album.art.cancel()
+            album.art = AlbumArt(self._art, album, self._album_width())
+        return album.art
+
+    def _resolve_art(self, model, iter, album):
+        row = Gtk.TreeRowReference.new(model, model.get_path(iter))
+
+        def on_art_ready(tile, _):
+            path = row.get_path()
+            if path:
+                model.row_changed(path, model.get_iter(path))
+            self.queue_draw()
+            self._queue_prefetch()
+
+        handle = album.art.resolve(on_art_ready, None)
+        handle.on_failure(self._queue_prefetch)
+
+    def _queue_prefetch(self):
+        if not self._prefetch_queued:
+            self._prefetch_queued = True
+            GLib.idle_add(self._prefetch)
+
+    def _prefetch(self):
+        self._prefetch_queued = False
+        self._fetching = {art for art in self._fetching if art.is_pending()}
+        visible = self._visible_rows()
+        if visible is None:
+            return False
+        border_color = self._get_border_color()
+        for i in self._prefetch_order(*visible):
+            if len(self._fetching) >= Albums.PrefetchConcurrency:
+                break
+            row = self._model[i]
+            if self._surface_key(row[0], border_color) in self._surfaces:
+                continue
+            art = self._album_art(row[0])
+            if art.needs_resolving():
+                self._resolve_art(self._model, row.iter, row[0])
+                self._fetching.add(art)
+        return False
+
+    def _prefetch_order(self, first, last):
+        """
+        Returns the indices of the rows to fetch art for, from the
+        most to the least urgent: the visible rows, then the ones
+        below, then the ones above.
+        """
+        ahead = (last - first + 1) * Albums.PrefetchScreens
+        below = range(last + 1, min(last + 1 + ahead, len(self._model)))
+        above = range(first - 1, max(first - 1 - ahead, -1), -1)
+        return [*range(first, last + 1), *below, *above]
+
+    def _cancel_art(self, keep_from=0, keep_to=None):
+        """
+        Cancels the pending art requests of the albums outside of the
+        rows keep_from to keep_to, or of all albums by default.
+        """
+        for i, row in enumerate(self._model):
+            if keep_to is not None and keep_from <= i <= keep_to:
+                continue
+            art = row[0].art
+            if art is not None and art.is_pending():
+                art.cancel()
+
+    def _visible_rows(self):
+        """
+        Returns the indices of the first and last visible rows, or None
+        if no rows are visible.
+        """
+        ok, start, end = self._view.get_visible_range()
+        if not ok:
+            return None
+        return start.get_indices()[0], end.get_indices()[0]
+
+    def _on_scroll(self, adjustment):
+        visible = self._visible_rows()
+        if visible is None:
+            return
+        first, last = visible
+        margin = (last - first + 1) * Albums.ArtKeepScreens
+        self._cancel_art(first - margin, last + margin)
+        self._queue_prefetch()
+
     def on_album_size(self, size):
         if size != self._options.album_size:
             self._create_placeholder_surface()
-            self._surface_cache.clear()
             self._options.album_size = size
             self.remove(self._view)
             del self._view
@@ -132,11 +240,10 @@ class Albums(Gtk.ScrolledWindow):
         return self.get_scale_factor() * self._options.album_size
 
     def _on_scale(self, widget, scale):
-        self._surface_cache.clear()
         self.queue_draw()
 
     def on_theme_change(self):
-        self._surface_cache.clear()
+        self.queue_draw()
 
     def _get_border_color(self):
         flags = Gtk.StateFlags.NORMAL
@@ -192,9 +299,20 @@ class Albums(Gtk.ScrolledWindow):
     def on_reload(self):
         self.clear()
 
+    def on_covers_changed(self):
+        # Covers found or missed earlier are looked for again, and the
+        # albums shown drop their art so that it is resolved afresh.
+        self._cancel_art()
+        self._art.revalidate_covers()
+        self._surfaces.clear()
+        for row in self._model:
+            row[0].art = None
+        self._queue_prefetch()
+        self.queue_draw()
+
     def clear(self):
+        self._cancel_art()
         self._clear_albums()
-        self._surface_cache.clear()
 
     def get_selected_album(self):
         return self._selected_album
@@ -211,8 +329,9 @@ class Albums(Gtk.ScrolledWindow):
     def on_artist_selected(self, artist_name, albums):
         if not artist_name or self._selected_artist == artist_name:
             return
+        self._cancel_art()
         self._clear_albums()
-        self._surface_cache.clear()
         self._selected_artist = artist_name
         for album in sorted(list(albums), key=Albums.album_sort_key):
             self._model.append([album])
+        self._queue_prefetch()
@@ -9,12 +9,17 @@ from .nowplaying import NowPlaying
 from .playlist import PlaylistContainer
 from .settings import SettingsMenu, OutputsSettings
 from .toolkit import glib_main
-from ..nmpd.mpdlib import MpdHeartbeat as Hb
+from ..nmpd.mpdlib import MpdConnectionStatus, MpdHeartbeat as Hb
 
 
 class App(Gtk.ApplicationWindow):
     Title = 'NeonMeate'
 
+    # Distinct album covers of the queue that are decoded ahead of
+    # time. Covers are large at the now playing size, so only the
+    # first few albums are worth keeping in the cache.
+    QueueArtWarmup = 16
+
     PlayStatus = {
         'play': (False, False),
         'pause': (True, False),
@@ -165,6 +170,10 @@ class App(Gtk.ApplicationWindow):
         )
         self._mpdhb.connect(Hb.SIG_PLAYBACK_MODE_TOGGLED, self._on_mode_change)
         self._mpdhb.connect(Hb.SIG_UPDATING_DB, self._on_updating_db)
+        self._connstatus.connect(
+            MpdConnectionStatus.SIG_MPD_STATE,
+            self._on_connection_state
+        )
         self._configstate.connect(
             'notify::albums-include-comps',
             self._on_albums_view_change
@@ -214,22 +223,25 @@ class App(Gtk.ApplicationWindow):
 
     def on_connect_attempt(self, settings, host, port, should_connect):
         with self._settings.handler_block(self._connect_handler):
-            if self._connstatus == should_connect:
-                return
             if should_connect:
-                if self._playlist_updated:
-                    self._playlist_updated = False
+                self._playlist_updated = False
                 self._mpdclient.connect()
-                self._artists.on_mpd_connected(True)
-                self._settings.on_outputs(self._mpdclient.get_outputs())
             else:
-                self._playlist_updated = False
-                self._titlebar.set_title('NeonMeate')
-                self._artists.on_mpd_connected(False)
-                self._playlist.clear()
-                self._now_playing.on_connection_status(False)
                 self._mpdclient.disconnect()
-                self._settings.on_outputs([])
+
+    def _on_connection_state(self, connstatus, state):
+        # While reconnecting, the views keep their contents so that a
+        # brief outage does not empty them.
+        if state == MpdConnectionStatus.CONNECTED:
+            self._artists.on_mpd_connected(True)
+            self._settings.on_outputs(self._mpdclient.get_outputs())
+        elif state == MpdConnectionStatus.DISCONNECTED:
+            self._playlist_updated = False
+            self._titlebar.set_title('NeonMeate')
+            self._artists.on_mpd_connected(False)
+            self._playlist.clear()
+            self._now_playing.on_connection_status(False)
+            self._settings.on_outputs([])
 
     def _no_song(self, hb):
         self._on_song_changed(hb, None, None, None, None)
@@ -248,40 +260,42 @@ class App(Gtk.ApplicationWindow):
             self._artists.on_playlist_modified()
 
         @glib_main
-        def on_current_queue(playqueue):
-            self._update_play_queue(playqueue)
+        def on_queue_diff(diff):
+            self._update_play_queue(diff)
             self._playlist_updated = True
 
-        self._mpdclient.playlistinfo(on_current_queue)
+        self._mpdclient.playlist_changes(on_queue_diff)
         self._spinner.stop()
 
-    def _update_play_queue(self, playqueue):
-        self._playlist.clear()
-        artist_elems = [e for e in playqueue if 'artist' in e]
-        for elem in artist_elems:
+    def _update_play_queue(self, diff):
+        if diff.full:
+            self._playlist.clear()
+        album_dirs = []
+        for position, elem in diff.changes:
             queue_elem = App._track_details_from_queue_elem(elem)
-            artist = queue_elem['artist']
-            album = queue_elem['album']
-            self._playlist.add_playlist_item(queue_elem)
-            cover_path = self._art.resolve_cover_file(
-                os.path.dirname(elem['file']))
-            self._on_resolved_cover_path(cover_path, artist, album)
-
-    def _on_resolved_cover_path(self, cover_path, artist, album):
-        if cover_path is None:
-            self.logger.warning(f"Cover not found for {artist} {album}")
-        else:
-            self._art.fetch(cover_path, None, None)
+            self._playlist.set_playlist_item(position, queue_elem)
+            if 'artist' in elem:
+                album_dirs.append(os.path.dirname(elem['file']))
+        self._playlist.truncate(diff.length)
+        album_dirs = list(dict.fromkeys(album_dirs))
+        self._art.warm_up(
+            album_dirs[:App.QueueArtWarmup],
+            NowPlaying.CoverEdgeSize
+        )
 
     @staticmethod
     def _track_details_from_queue_elem(elem):
         """
-        Cleans up the playlist entries that come from MPD.
+        Cleans up the playlist entries that come from MPD. Entries
+        missing tags are kept, so that rows stay aligned with queue
+        positions.
         """
-        artist, album, title = elem['artist'], elem['album'], elem['title']
-        track = int(elem['track'])
+        artist = elem.get('artist', '')
+        album = elem.get('album', '')
+        title = elem.get('title', os.path.basename(elem['file']))
+        track = int(elem.get('track', 0))
         position = int(elem['pos'])
-        duration = float(elem['duration'])
+        duration = float(elem.get('duration', 0))
         seconds = int(duration)
 
         if isinstance(title, list):
@@ -311,7 +325,6 @@ class App(Gtk.ApplicationWindow):
         if covpath is None:
             self.logger.error(f'File art not found for {filepath}')
         else:
-            self._art.fetch(covpath, None, None)
             self._now_playing.on_playing(artist, album, covpath)
 
     def _on_song_playing_status(self, hb, status):
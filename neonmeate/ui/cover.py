@@ -113,6 +113,9 @@ class CoverWithGradient(Gtk.DrawingArea):
             self._update_grad(RGBColor(*a), RGBColor(*b))
         else:
             self.logger.debug(f'Cached clusters not found for {covpath}')
+            budget = self._cfg.palette_pixel_budget()
+            if not budget or cluster.np is None:
+                budget = None
             cluster_result = executor.execute_async(
                 cluster.clusterize,
                 pixbuf,
@@ -121,7 +124,8 @@ class CoverWithGradient(Gtk.DrawingArea):
                 7,
                 0.001,
                 200,
-                'rgb')
+                'rgb',
+                pixel_budget=budget)
             cluster_result.add_done_callback(on_gradient_ready)
 
     @glib_main
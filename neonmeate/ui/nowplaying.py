@@ -5,6 +5,10 @@ from .cover import CoverWithGradient
 
 # noinspection PyUnresolvedReferences
 class NowPlaying(Gtk.Bin):
+    # The cover is decoded at this size, which is enough for the
+    # view to fill a large window without decoding huge scans.
+    CoverEdgeSize = 1024
+
     def __init__(self, rng, art_cache, executor, cfg):
         super(NowPlaying, self).__init__()
         self._cfg = cfg
@@ -31,7 +35,12 @@ class NowPlaying(Gtk.Bin):
             return
         self._clear_art()
         self._current = (artist, album)
-        self._art.fetch(covpath, self._on_art_ready, (artist, album, covpath))
+        self._art.fetch(
+            covpath,
+            self._on_art_ready,
+            (artist, album, covpath),
+            NowPlaying.CoverEdgeSize
+        )
 
     def switch_art(self):
         artist, album = self._current
@@ -112,6 +112,12 @@ class PlaylistContainer(Gtk.Frame):
     def add_playlist_item(self, item):
         self._playlist.add_playlist_item(item)
 
+    def set_playlist_item(self, position, item):
+        self._playlist.set_playlist_item(position, item)
+
+    def truncate(self, length):
+        self._playlist.truncate(length)
+
 
 class Playlist(Gtk.ScrolledWindow):
     SIG_DEL_PLAYLIST_ITEM = 'neonmeate_delitem_playlist'
@@ -171,7 +177,17 @@ class Playlist(Gtk.ScrolledWindow):
         self._playlist_table.clear()
 
     def add_playlist_item(self, item):
-        row = [
+        self._playlist_table.add(Playlist._row(item))
+
+    def set_playlist_item(self, position, item):
+        self._playlist_table.set_row(position, Playlist._row(item))
+
+    def truncate(self, length):
+        self._playlist_table.truncate(length)
+
+    @staticmethod
+    def _row(item):
+        return [
             Playlist.format_track_no(item['track']),
             item['artist'],
             item['album'],
@@ -179,4 +195,3 @@ class Playlist(Gtk.ScrolledWindow):
             format_seconds(item['seconds']),
             item['position']
         ]
-        self._playlist_table.add(row)
@@ -1,5 +1,6 @@
 from gi.repository import Gtk, GObject
 
+from ..nmpd.mpdlib import MpdConnectionStatus
 from ..util.config import main_config_file
 
 
@@ -289,13 +290,23 @@ class SettingsMenu(Gtk.Popover):
         SIG_ALBUM_SCALE_CHANGE: (GObject.SignalFlags.RUN_FIRST, None, (int,))
     }
 
+    ConnectionLabels = {
+        MpdConnectionStatus.DISCONNECTED: 'Connect',
+        MpdConnectionStatus.CONNECTING: 'Connecting…',
+        MpdConnectionStatus.CONNECTED: 'Connected',
+        MpdConnectionStatus.RECONNECTING: 'Reconnecting…'
+    }
+
     def __init__(self, executor, configstate, connstatus, cfg):
         super(SettingsMenu, self).__init__()
         self._exec = executor
         self._cfg = cfg
         self._configstate = configstate
         self._connstatus = connstatus
-        self._connstatus.connect('mpd_connected', self._on_mpd_connection)
+        self._connstatus.connect(
+            MpdConnectionStatus.SIG_MPD_STATE,
+            self._on_mpd_connection
+        )
         spacing = 16
         self.set_border_width(spacing)
         self._box = Gtk.VBox()
@@ -314,11 +325,9 @@ class SettingsMenu(Gtk.Popover):
         notebook.append_page(self._output_settings, Gtk.Label('Outputs'))
         notebook.append_page(self._interface_settings, Gtk.Label('Interface'))
 
-        self._connect_label = Gtk.Label('Connect')
-        self._connected_label = Gtk.Label('Connected')
         self._connect_switch = Gtk.ToggleButton()
-        self._connect_switch.add(self._connect_label)
-        self._connect_switch.connect(
+        self._connect_switch.add(Gtk.Label('Connect'))
+        self._connect_switch_id = self._connect_switch.connect(
             'notify::active',
             self._on_user_connect_change
         )
@@ -367,10 +376,13 @@ class SettingsMenu(Gtk.Popover):
     def _on_outputs_change(self, outputsmenu, id, enabled):
         self.emit(SettingsMenu.SIG_OUTPUT_CHANGE, id, enabled)
 
-    def _on_mpd_connection(self, _, success):
+    def _on_mpd_connection(self, _, state):
         switch = self._connect_switch
-        switch.set_active(success)
-        label = self._connected_label if success else self._connect_label
+        active = state != MpdConnectionStatus.DISCONNECTED
+        with switch.handler_block(self._connect_switch_id):
+            switch.set_active(active)
+        self._network_settings.on_connected(active)
+        label = Gtk.Label(SettingsMenu.ConnectionLabels[state])
         for c in switch.get_children():
             switch.remove(c)
         switch.add(label)
@@ -390,9 +402,9 @@ class SettingsMenu(Gtk.Popover):
         self.emit(SettingsMenu.SIG_MUSIC_DIR_UPDATED, chosen)
 
     # This is called when the user toggles the connection
-    # switch in the config panel. This will result in
-    # _on_mpd_connection being called to update the label
-    # text based on the current status.
+    # switch in the config panel. The connection status will
+    # then result in _on_mpd_connection being called to update
+    # the label text as the connection progresses.
     def _on_user_connect_change(self, switch, gparam):
         connected = switch.get_active()
         self._network_settings.on_user_connect_change(connected)
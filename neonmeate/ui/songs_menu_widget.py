@@ -249,6 +249,9 @@ class SongsMenu(Gtk.Popover):
 
     def _add_selected(self):
         songs = self._get_selected_songs()
+        if len(songs) == len(self._songs):
+            self._mpdclient.add_album_to_playlist(self._album)
+            return
         ordered = sorted(songs, key=lambda s: (s.discnum, s.number))
         if ordered:
             self._mpdclient.add_songs(ordered)
@@ -64,45 +64,83 @@ class TimedInfoBar(Gtk.InfoBar):
 
 class AlbumArt:
     """
-    Asynchronously resolved album artwork. This will initially be a
-    pixbuf that is the placeholder image, but will change to the album
-    artwork once that has been loaded.
+    Asynchronously resolved album artwork, as a tile of the thumbnail
+    atlas for the edge size. Until that has been loaded, callers show
+    a placeholder of their own.
     """
-    ScaleMode = GdkPixbuf.InterpType.BILINEAR
 
-    def __init__(self, artcache, album, placeholder_pixbuf):
+    def __init__(self, artcache, album, edge_size):
         self._art = artcache
         self._album = album
         self._resolved = None
-        self._placeholder = placeholder_pixbuf
+        self._handle = None
+        self.edge_size = edge_size
 
     def is_resolved(self):
         return self._resolved is not None
 
-    def get_scaled_pixbuf(self, edge_size):
-        pixbuf = self._resolved if self.is_resolved() else self._placeholder
-        return scale_pixbuf(pixbuf, edge_size)
+    def is_pending(self):
+        return self._handle is not None and not self.is_resolved() and \
+               not self._handle.has_failed()
+
+    def needs_resolving(self):
+        """
+        Returns whether resolve() is yet to be called, or the resolution
+        was cancelled since. Albums without a cover, or whose cover
+        could not be loaded, are not resolved again.
+        """
+        return self._handle is None
+
+    def cancel(self):
+        """
+        Cancels the resolution if it is in progress. It can be started
+        again later by calling resolve().
+        """
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def get_tile(self):
+        """Returns the artwork as a cairo surface, or None if unresolved."""
+        return self._resolved
 
     def resolve(self, on_done, user_data):
         """
         Asychronously resolves and loads the cover artwork file into a
-        pixbuf.  Calls the user-supplied callback with the new pixbuf
+        surface of edge_size pixels square, using the thumbnail atlas of
+        the ArtCache. Calls the user-supplied callback with the surface
         when done. The user_data is arbitrary data that will be passed
         along to the callback.
 
+        Returns the ArtHandle of the resolution. If the album has no
+        cover, or it cannot be loaded, the callback is not called and
+        the handle is marked as failed instead.
         """
 
         @glib_main
-        def _on_art_ready(pixbuf, data):
-            self._resolved = pixbuf
-            on_done(pixbuf, data)
+        def _on_art_ready(tile, data):
+            self._resolved = tile
+            on_done(tile, data)
 
         @glib_main
         def _on_cover_path(cover_path):
-            if cover_path:
-                self._art.fetch(cover_path, _on_art_ready, user_data)
-
-        self._art.async_resolve_cover_file(self._album.dirpath, _on_cover_path)
+            if not cover_path:
+                handle.fail()
+            elif not handle.is_cancelled():
+                self._art.fetch_tile(
+                    cover_path,
+                    self.edge_size,
+                    _on_art_ready,
+                    user_data,
+                    handle
+                )
+
+        handle = self._art.async_resolve_cover_file(
+            self._album.dirpath,
+            _on_cover_path
+        )
+        self._handle = handle
+        return handle
 
 
 class Scrollable(Gtk.ScrolledWindow):
@@ -180,6 +218,25 @@ class Table:
     def add(self, col_values):
         self._model.append(col_values)
 
+    def __len__(self):
+        return len(self._model)
+
+    def set_row(self, index, col_values):
+        """
+        Replaces the row at index, or appends a row if the index is
+        one past the end.
+        """
+        if index < len(self._model):
+            self._model[index] = col_values
+        else:
+            self._model.append(col_values)
+
+    def truncate(self, length):
+        """Removes rows from the end until there are length rows."""
+        while len(self._model) > length:
+            last = self._model.iter_nth_child(None, len(self._model) - 1)
+            self._model.remove(last)
+
     def as_widget(self):
         self._tree = Gtk.TreeView.new_with_model(self._model)
 
@@ -227,7 +284,24 @@ class BooleanRef:
 
 
 def add_pixbuf_border(pixbuf, color, border_width=4):
-    w, h = pixbuf.get_width(), pixbuf.get_height()
+    surface = _draw_pixbuf_border(pixbuf, color, border_width)
+    w, h = surface.get_width(), surface.get_height()
+    return Gdk.pixbuf_get_from_surface(surface, 0, 0, w, h)
+
+
+def bordered_surface(image, color, scale, border_width=4):
+    """
+    Like add_pixbuf_border(), but returns the cairo surface itself, for
+    the given scale factor, rather than copying it back into a pixbuf.
+    The image can be a pixbuf or a cairo image surface.
+    """
+    surface = _draw_pixbuf_border(image, color, border_width)
+    surface.set_device_scale(scale, scale)
+    return surface
+
+
+def _draw_pixbuf_border(image, color, border_width):
+    w, h = image.get_width(), image.get_height()
     w += border_width * 2
     h += border_width * 2
     surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, w, h)
@@ -235,10 +309,13 @@ def add_pixbuf_border(pixbuf, color, border_width=4):
     ctx.new_path()
     ctx.rectangle(0, 0, w, h)
     ctx.close_path()
-    Gdk.cairo_set_source_pixbuf(ctx, pixbuf, border_width, border_width)
+    if isinstance(image, cairo.ImageSurface):
+        ctx.set_source_surface(image, border_width, border_width)
+    else:
+        Gdk.cairo_set_source_pixbuf(ctx, image, border_width, border_width)
     ctx.clip_preserve()
     ctx.paint()
     ctx.set_source_rgba(color.red, color.green, color.blue, color.alpha)
     ctx.set_line_width(border_width * 2)
     ctx.stroke()
-    return Gdk.pixbuf_get_from_surface(surface, 0, 0, w, h)
+    return surface
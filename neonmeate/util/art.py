@@ -1,54 +1,52 @@
+import hashlib
+import json
 import os
+import threading
 
 import gi
 import logging
-import heapq
-import time
+
+from collections import deque, OrderedDict
+from functools import partial
 
 gi.require_version('GdkPixbuf', '2.0')
 
 from gi.repository import GdkPixbuf, Gio, GLib, GObject
 
+from .atlas import ThumbnailAtlas
+from .config import neonmeate_cache_dir
+from ..ui.toolkit import glib_main
 
-class PriorityQueue:
-    def __init__(self, key):
-        self._q = []
-        self._key = key
-
-    def add(self, item):
-        t = (self._key(item), item)
-        self._q.append(t)
-        heapq.heappush(self._q, t)
 
-    def __len__(self):
-        return len(self._q)
+def pixbuf_bytes(pixbuf):
+    """Returns the number of bytes of pixel data held by the pixbuf."""
+    return pixbuf.get_rowstride() * pixbuf.get_height()
 
-    def clear(self):
-        self._q.clear()
 
-    def pop_min(self):
-        _, item = heapq.heappop(self._q)
-        return item
-
-    def update(self, item, key_fn):
-        k = key_fn(item)
-        for i, tup in enumerate(self._q):
-            _, elem = tup
-            if key_fn(elem) == k:
-                del self._q[i]
-                break
-        self.add(item)
+def surface_bytes(surface):
+    """Returns the number of bytes of pixel data held by the surface."""
+    return surface.get_stride() * surface.get_height()
 
 
 class LruCoverCache:
-    def __init__(self, max_size):
-        self._max_size = max_size
-        self._q = PriorityQueue(lambda cachekey: cachekey.last_access_time)
-        self._key_by_path = {}
-        self._img_cache = {}
+    """
+    Least recently used cache of decoded covers, which is bounded by
+    the bytes of pixel data it holds rather than by the number of
+    covers. Lookups, insertions and evictions are all O(1). The hit,
+    miss and eviction counts are kept for diagnostics.
+    """
+
+    def __init__(self, max_bytes, size_of=pixbuf_bytes):
+        self._max_bytes = max_bytes
+        self._size_of = size_of
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
     def __contains__(self, item):
-        return item in self._key_by_path
+        return item in self._entries
 
     def __getitem__(self, item):
         return self.get(item)
@@ -56,35 +54,196 @@ class LruCoverCache:
     def __setitem__(self, key, value):
         self.put(key, value)
 
+    def __len__(self):
+        return len(self._entries)
+
     def clear(self):
-        self._key_by_path = {}
-        self._img_cache = {}
-        self._q.clear()
-
-    def get(self, file_path):
-        key = self._key_by_path.get(file_path, None)
-        if key:
-            key.update_access_time()
-            self._q.update(key, lambda cachekey: cachekey.file_path)
-            return self._img_cache[key.file_path]
-        return None
-
-    def put(self, file_path, pixbuf):
-        while len(self._q) >= self._max_size:
-            self._q.pop_min()
-        key = CacheKey(file_path)
-        self._key_by_path[file_path] = key
-        self._img_cache[file_path] = pixbuf
-        self._q.add(key)
-
-
-class CacheKey:
-    def __init__(self, file_path):
-        self.file_path = file_path
-        self.last_access_time = time.monotonic_ns()
+        self._entries.clear()
+        self._bytes = 0
+
+    def discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def get(self, key):
+        entry = self._entries.get(key, None)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        size = self._size_of(value)
+        self._entries[key] = (value, size)
+        self._bytes += size
+        # The newest entry stays even if it alone exceeds the budget
+        while self._bytes > self._max_bytes and len(self._entries) > 1:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'bytes': self._bytes,
+            'max_bytes': self._max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class ThumbnailCache:
+    """
+    Scaled down covers stored on disk, so that cover files, which can
+    be several megabytes, are decoded once rather than on every visit
+    to an artist. A thumbnail is keyed by the path, modification time
+    and size of the cover file along with the edge size it was scaled
+    to, so a replaced cover gets a new thumbnail.
+    """
+
+    def __init__(self, directory):
+        self._dir = directory
+        self._log = logging.getLogger(__name__)
+
+    def path_for(self, cover_path, edge_size):
+        """
+        Returns the path of the thumbnail for the cover, or None if the
+        cover file cannot be read.
+        """
+        try:
+            st = os.stat(cover_path)
+        except OSError:
+            return None
+        key = f'{cover_path}\0{st.st_mtime_ns}\0{st.st_size}\0{edge_size}'
+        digest = hashlib.sha1(
+            key.encode('utf-8', 'surrogateescape')
+        ).hexdigest()
+        return os.path.join(self._dir, digest[:2], f'{digest}.png')
+
+    def load(self, thumb_path):
+        if not os.path.exists(thumb_path):
+            return None
+        try:
+            return GdkPixbuf.Pixbuf.new_from_file(thumb_path)
+        except GLib.GError as e:
+            self._log.warning(f'Failed to load thumbnail {thumb_path}: {e}')
+            return None
+
+    def save(self, thumb_path, pixbuf):
+        tmp_path = f'{thumb_path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+            pixbuf.savev(tmp_path, 'png', [], [])
+            os.replace(tmp_path, thumb_path)
+        except (OSError, GLib.GError) as e:
+            self._log.warning(f'Failed to save thumbnail {thumb_path}: {e}')
+
+
+class CoverResolver:
+    """
+    Finds the cover file of album directories by listing each directory
+    once and matching the cover names regardless of case, rather than
+    probing every name. Directories with and without a cover are both
+    remembered along with the directory's modification time, and the
+    map is persisted between sessions. A remembered entry is checked
+    against the directory's modification time the first time it is
+    used in a session, so covers added or removed since are noticed.
+    """
+
+    def __init__(self, cover_names, cache_file):
+        # Lower rank wins when a directory has several cover files
+        self._ranks = {name.lower(): i for i, name in enumerate(cover_names)}
+        self._cache_file = cache_file
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._validated = set()
+        self._dirty = False
+        self._log = logging.getLogger(__name__)
+        self._load()
+
+    def resolve(self, directory):
+        """
+        Returns the full path of the cover in the directory, or None if
+        it has none.
+        """
+        with self._lock:
+            entry = self._entries.get(directory, None)
+            if entry is not None and directory in self._validated:
+                return self._cover_path(directory, entry)
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return None
+        if entry is None or entry[0] != mtime:
+            try:
+                entry = [mtime, self._scan(directory)]
+            except OSError:
+                return None
+        with self._lock:
+            if self._entries.get(directory, None) != entry:
+                self._entries[directory] = entry
+                self._dirty = True
+            self._validated.add(directory)
+        return self._cover_path(directory, entry)
 
-    def update_access_time(self):
-        self.last_access_time = time.monotonic_ns()
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._validated = set()
+            self._dirty = True
+
+    def revalidate(self):
+        """
+        Makes each remembered entry be checked against its directory's
+        modification time again the next time it is used.
+        """
+        with self._lock:
+            self._validated = set()
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            entries = dict(self._entries)
+            self._dirty = False
+        tmp_file = f'{self._cache_file}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self._cache_file), exist_ok=True)
+            with open(tmp_file, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp_file, self._cache_file)
+        except OSError as e:
+            self._log.warning(f'Failed to save {self._cache_file}: {e}')
+
+    def _load(self):
+        if not os.path.exists(self._cache_file):
+            return
+        try:
+            with open(self._cache_file, 'r') as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError) as e:
+            self._log.warning(f'Ignoring {self._cache_file}: {e}')
+
+    def _scan(self, directory):
+        best_rank, best_name = len(self._ranks), None
+        with os.scandir(directory) as it:
+            for entry in it:
+                rank = self._ranks.get(entry.name.lower(), None)
+                if rank is not None and rank < best_rank and entry.is_file():
+                    best_rank, best_name = rank, entry.name
+        return best_name
+
+    @staticmethod
+    def _cover_path(directory, entry):
+        name = entry[1]
+        return os.path.join(directory, name) if name else None
 
 
 # noinspection PyUnresolvedReferences
@@ -102,26 +261,78 @@ class ArtCache(GObject.GObject):
                   for base in ['cover', 'front', 'folder', 'art']
                   for ext in ['jpg', 'png', 'gif']]
 
-    def __init__(self, configstate, executor):
+    # Budget for the decoded covers held in memory
+    CacheBytes = 128 * 1024 * 1024
+
+    # Budget for the ready to paint cover surfaces held in memory
+    SurfaceBytes = 64 * 1024 * 1024
+
+    # Most thread pool tasks that warm_up() keeps busy at once
+    WarmupConcurrency = 2
+
+    def __init__(self, configstate, executor, image_pool=None):
         self._configstate = configstate
         self._configstate.connect('notify::musicpath', self._on_music_path)
-        self._cache = LruCoverCache(256)
+        self._cache = LruCoverCache(ArtCache.CacheBytes)
+        self._surfaces = LruCoverCache(
+            ArtCache.SurfaceBytes,
+            size_of=surface_bytes
+        )
+        self._thumbnails = ThumbnailCache(
+            os.path.join(neonmeate_cache_dir(), 'thumbnails')
+        )
+        self._atlases = {}
         self._root_music_dir = configstate.get_musicpath()
         self._pending_requests = {}
-        self._cover_file_names = ArtCache.CoverNames
+        self._resolver = CoverResolver(
+            ArtCache.CoverNames,
+            os.path.join(neonmeate_cache_dir(), 'covers.json')
+        )
         self._thread_pool = executor
+        self._image_pool = image_pool
+        self._warmup_lock = threading.Lock()
+        self._warmup_queue = deque()
+        self._warmup_seen = set()
+        self._warmup_workers = 0
         self._log = logging.getLogger(__name__)
 
     def _on_music_path(self, configstate, _):
         self._root_music_dir = configstate.get_musicpath()
         self._cache.clear()
+        with self._warmup_lock:
+            self._warmup_queue.clear()
+            self._warmup_seen.clear()
+
+    def cache_stats(self):
+        """Returns the counters of the in-memory cover cache."""
+        return self._cache.stats()
+
+    def surface_cache(self):
+        """
+        Returns the cache of cover surfaces for the albums view, which
+        holds cairo surfaces ready to be painted. They are keyed by
+        whatever their look depends on, i.e. (album directory, edge
+        size, scale factor, border color, border width), so surfaces
+        made for other sizes or themes stay around to be reused.
+        """
+        return self._surfaces
+
+    def async_resolve_cover_file(self, dirpath, on_ready, handle=None):
+        """
+        Resolves the cover on the thread pool and passes its path to
+        on_ready, unless the returned ArtHandle is cancelled first.
+        """
+        handle = handle or ArtHandle()
 
-    def async_resolve_cover_file(self, dirpath, on_ready):
         def runnable():
+            if handle.is_cancelled():
+                return
             path = self.resolve_cover_file(dirpath)
-            on_ready(path)
+            if not handle.is_cancelled():
+                on_ready(path)
 
         self._thread_pool.execute_async(runnable)
+        return handle
 
     def resolve_cover_file(self, dirpath):
         """
@@ -132,13 +343,94 @@ class ArtCache(GObject.GObject):
         :return: full path to the album art file,
         or None if it could not be found
         """
-        for f in self._cover_file_names:
-            fullpath = os.path.join(self._root_music_dir, dirpath, f)
-            if os.path.exists(fullpath):
-                return fullpath
-        return None
+        return self._resolver.resolve(
+            os.path.join(self._root_music_dir, dirpath)
+        )
+
+    def revalidate_covers(self):
+        """
+        Makes the covers of directories be looked for again, for when
+        they may have been added, removed or replaced.
+        """
+        self._resolver.revalidate()
+
+    def warm_up(self, dirpaths, edge_size):
+        """
+        Resolves and decodes the covers of the directories (relative
+        to the music dir) at edge_size in the background, so that they
+        are cached by the time they are shown. Each directory is only
+        handled once per edge size.
+
+        The work is done one cover per thread pool task, by at most
+        WarmupConcurrency tasks at a time. After each cover the task
+        is resubmitted behind whatever else was queued meanwhile, so
+        the warm up only gets the pool when nothing else wants it.
+        """
+        with self._warmup_lock:
+            for dirpath in dirpaths:
+                key = (dirpath, edge_size)
+                if key not in self._warmup_seen:
+                    self._warmup_seen.add(key)
+                    self._warmup_queue.append(key)
+            while self._warmup_queue and \
+                    self._warmup_workers < ArtCache.WarmupConcurrency:
+                self._warmup_workers += 1
+                self._thread_pool.execute_async(self._warm_up_next)
+
+    def _warm_up_next(self):
+        with self._warmup_lock:
+            if not self._warmup_queue:
+                self._warmup_workers -= 1
+                return
+            dirpath, edge_size = self._warmup_queue.popleft()
+        try:
+            cover_path = self.resolve_cover_file(dirpath)
+            key = (cover_path, edge_size)
+            if cover_path is not None and key not in self._cache:
+                pixbuf = self._decode_in_pool(cover_path, edge_size)
+                if pixbuf is None:
+                    pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(
+                        cover_path,
+                        edge_size,
+                        edge_size,
+                        False
+                    )
+                self._on_warmed_up(key, pixbuf)
+        except GLib.GError as e:
+            self._log.debug(f'cover warm up failed for {dirpath}: {e}')
+        finally:
+            self._thread_pool.execute_async(self._warm_up_next)
+
+    def _decode_in_pool(self, file_path, edge_size):
+        """
+        Decodes the image in the image pool, if there is one, blocking
+        until it is done. Returns None if that is not possible, so
+        that the caller can decode it in process instead.
+        """
+        if self._image_pool is None:
+            return None
+        try:
+            return self._image_pool.submit(file_path, edge_size).result()
+        except Exception as e:
+            self._log.debug(f'image pool failed to decode {file_path}: {e}')
+            return None
+
+    @glib_main
+    def _on_warmed_up(self, key, pixbuf):
+        if key not in self._cache:
+            self._cache[key] = pixbuf
 
-    def fetch(self, file_path, callback, user_data):
+    def save(self):
+        """
+        Persists what was learned about cover locations, and the
+        indices of the thumbnail atlases.
+        """
+        self._resolver.save()
+        for atlas in self._atlases.values():
+            atlas.save()
+
+    def fetch(self, file_path, callback, user_data, edge_size=None,
+              handle=None):
         """
         Asynchronously loads the image at file_path
         and provides it to the callback as a GdkPixbuf
@@ -147,68 +439,319 @@ class ArtCache(GObject.GObject):
         The caller can also supply arbitrary data for the
         user_data parameter and that will be given to the
         callback as well.
+
+        If edge_size is given, the image is decoded straight
+        to edge_size pixels square, which takes a fraction of
+        the time and memory of decoding it at full size (JPEG
+        images are scaled while decoding). Images are cached
+        per path and edge size.
+
+        Returns an ArtHandle, which can be used to cancel the
+        request. Reading and decoding stop once every caller
+        waiting for the same image has cancelled.
         """
-        if file_path in self._cache:
+        handle = handle or ArtHandle()
+        key = (file_path, edge_size)
+        pixbuf = self._cache.get(key)
+        if pixbuf is not None:
             if callback is not None:
-                callback(self._cache[file_path], user_data)
-            return
-        req = self._get_pending_or_create(file_path, callback, user_data)
+                callback(pixbuf, user_data)
+            return handle
+        already_pending = key in self._pending_requests
+        req = self._get_pending_or_create(key, callback, user_data, handle)
+        handle.on_cancel(partial(self._cancel_request, req, handle))
+        if already_pending:
+            return handle
         gio_file = Gio.File.new_for_path(file_path)
         gio_file.read_async(
             GLib.PRIORITY_DEFAULT,
-            None,
+            req.cancellable,
             self._on_stream_ready,
             req
         )
+        return handle
+
+    def _cancel_request(self, art_request, handle):
+        if art_request.remove_handle(handle):
+            return
+        art_request.cancellable.cancel()
+        if self._pending_requests.get(art_request.key, None) is art_request:
+            del self._pending_requests[art_request.key]
 
-    def _get_pending_or_create(self, file_path, callback, user_data):
+    def fetch_thumbnail(self, file_path, edge_size, callback, user_data,
+                        handle=None):
+        """
+        Like fetch() with an edge_size, but the scaled images
+        are also kept on disk, so a cover is only decoded the
+        first time a size is asked for. The callback is
+        called on the GTK main thread.
+
+        Covers without a thumbnail are decoded in the image
+        pool, if there is one.
+        """
+        handle = handle or ArtHandle()
+        key = (file_path, edge_size)
+        pixbuf = self._cache.get(key)
+        if pixbuf is not None:
+            callback(pixbuf, user_data)
+            return handle
+
+        def on_decoded(thumbnail, thumb_path):
+            if thumb_path is not None:
+                self._thread_pool.execute_async(
+                    self._thumbnails.save,
+                    thumb_path,
+                    thumbnail
+                )
+            callback(thumbnail, user_data)
+
+        @glib_main
+        def on_loaded(thumbnail, thumb_path):
+            if handle.is_cancelled():
+                return
+            if thumbnail is None:
+                self.fetch(
+                    file_path,
+                    on_decoded,
+                    thumb_path,
+                    edge_size,
+                    handle
+                )
+            else:
+                self._cache[key] = thumbnail
+                callback(thumbnail, user_data)
+
+        def load():
+            if handle.is_cancelled():
+                return
+            thumb_path = self._thumbnails.path_for(file_path, edge_size)
+            thumbnail = None
+            if thumb_path is not None:
+                thumbnail = self._thumbnails.load(thumb_path)
+            if thumbnail is None and not handle.is_cancelled():
+                thumbnail = self._decode_in_pool(file_path, edge_size)
+                if thumbnail is not None and thumb_path is not None:
+                    self._thumbnails.save(thumb_path, thumbnail)
+            on_loaded(thumbnail, thumb_path)
+
+        self._thread_pool.execute_async(load)
+        return handle
+
+    def fetch_tile(self, file_path, edge_size, callback, user_data,
+                   handle=None):
         """
-        Returns an ArtRequest for the path. If there is already
-        one pending, then it will be returned. Otherwise, creates
-        a new one.
+        Like fetch_thumbnail(), but provides the image as a cairo
+        surface, which is a tile of the thumbnail atlas for the
+        edge size. Covers already in the atlas are painted straight
+        from it, without being loaded or decoded. The callback is
+        called on the GTK main thread.
         """
-        if file_path in self._pending_requests:
-            r = self._pending_requests[file_path]
-            r.add_callback(callback, user_data)
+        handle = handle or ArtHandle()
+
+        def stat():
+            if handle.is_cancelled():
+                return
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                on_key(None)
+                return
+            on_key(f'{file_path}\0{st.st_mtime_ns}\0{st.st_size}')
+
+        @glib_main
+        def on_key(key):
+            if handle.is_cancelled():
+                return
+            if key is None:
+                handle.fail()
+                return
+            atlas = self._atlas(edge_size)
+            tile = atlas.get(key)
+            if tile is not None:
+                callback(tile, user_data)
+                return
+
+            def on_thumbnail(pixbuf, _):
+                callback(atlas.add(key, pixbuf), user_data)
+
+            # The decoded covers are not keyed by modification time,
+            # so one could predate a cover replaced in place. Dropping
+            # it makes the tile come from the current file, and the
+            # disk thumbnails are keyed by modification time.
+            self._cache.discard((file_path, edge_size))
+            self.fetch_thumbnail(
+                file_path,
+                edge_size,
+                on_thumbnail,
+                None,
+                handle
+            )
+
+        self._thread_pool.execute_async(stat)
+        return handle
+
+    def _atlas(self, edge_size):
+        atlas = self._atlases.get(edge_size, None)
+        if atlas is None:
+            atlas = ThumbnailAtlas(
+                os.path.join(neonmeate_cache_dir(), 'atlas'),
+                edge_size
+            )
+            self._atlases[edge_size] = atlas
+        return atlas
+
+    def _get_pending_or_create(self, key, callback, user_data, handle):
+        """
+        Returns an ArtRequest for the path and edge size. If
+        there is already one pending, then it will be returned.
+        Otherwise, creates a new one.
+        """
+        if key in self._pending_requests:
+            r = self._pending_requests[key]
+            r.add_callback(callback, user_data, handle)
         else:
-            r = ArtRequest(file_path, callback, user_data)
-            self._pending_requests[file_path] = r
+            file_path, edge_size = key
+            r = ArtRequest(file_path, edge_size, callback, user_data, handle)
+            self._pending_requests[key] = r
         return r
 
     def _on_stream_ready(self, src_object, result, art_request):
         try:
             stream = src_object.read_finish(result)
         except GLib.GError as e:
-            self._log.error(f'stream finish failed: {e.message}', e)
-        else:
-            GdkPixbuf.Pixbuf.new_from_stream_async(stream, None,
+            self._on_request_failed(art_request, e)
+            return
+        edge_size = art_request.edge_size
+        if edge_size is None:
+            GdkPixbuf.Pixbuf.new_from_stream_async(stream,
+                                                   art_request.cancellable,
                                                    self._on_pixbuf_ready,
                                                    art_request)
+        else:
+            GdkPixbuf.Pixbuf.new_from_stream_at_scale_async(
+                stream,
+                edge_size,
+                edge_size,
+                False,
+                art_request.cancellable,
+                self._on_pixbuf_ready,
+                art_request
+            )
 
     def _on_pixbuf_ready(self, src_object, result, art_request):
-        pixbuf = GdkPixbuf.Pixbuf.new_from_stream_finish(result)
-        self._cache[art_request.file_path] = pixbuf
+        try:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_stream_finish(result)
+        except GLib.GError as e:
+            self._on_request_failed(art_request, e)
+            return
+        self._remove_pending(art_request)
+        self._cache[art_request.key] = pixbuf
         art_request.on_completion(pixbuf)
-        if art_request.file_path in self._pending_requests:
-            del self._pending_requests[art_request.file_path]
+
+    def _on_request_failed(self, art_request, e):
+        self._remove_pending(art_request)
+        if not art_request.cancellable.is_cancelled():
+            self._log.error(f'failed to load {art_request.file_path}: '
+                            f'{e.message}')
+            art_request.on_failure()
+
+    def _remove_pending(self, art_request):
+        if self._pending_requests.get(art_request.key, None) is art_request:
+            del self._pending_requests[art_request.key]
+
+
+class ArtHandle:
+    """
+    Handle to an art request, such as a cover resolution or a fetch,
+    which the caller can use to cancel it. A cancelled request does
+    not call back. One handle can be passed along a chain of requests
+    made on behalf of the same caller, so that cancelling it cancels
+    whichever of them is in progress.
+
+    A request that ends without an image, e.g. because the file could
+    not be decoded, does not call back either, but marks the handle
+    as failed.
+    """
+
+    def __init__(self):
+        self._cancelled = False
+        self._cancel_actions = []
+        self._failed = False
+        self._failure_actions = []
+
+    def cancel(self):
+        if self._cancelled:
+            return
+        self._cancelled = True
+        actions, self._cancel_actions = self._cancel_actions, []
+        for action in actions:
+            action()
+
+    def is_cancelled(self):
+        return self._cancelled
+
+    def on_cancel(self, action):
+        """Arranges for action to be called when the handle is cancelled."""
+        if self._cancelled:
+            action()
+        else:
+            self._cancel_actions.append(action)
+
+    def fail(self):
+        if self._failed or self._cancelled:
+            return
+        self._failed = True
+        actions, self._failure_actions = self._failure_actions, []
+        for action in actions:
+            action()
+
+    def has_failed(self):
+        return self._failed
+
+    def on_failure(self, action):
+        """Arranges for action to be called when the request fails."""
+        if self._failed:
+            action()
+        else:
+            self._failure_actions.append(action)
 
 
 class ArtRequest:
     """
     A request to fetch an image file. Once the file has
     been loaded, the associated callbacks will be called
-    on the GTK main thread.
+    on the GTK main thread, except for those whose handle
+    was cancelled.
     """
 
-    def __init__(self, file_path, callback, user_data):
+    def __init__(self, file_path, edge_size, callback, user_data, handle):
         self.file_path = file_path
+        self.edge_size = edge_size
+        self.key = (file_path, edge_size)
+        self.cancellable = Gio.Cancellable()
         self._callbacks = []
-        self.add_callback(callback, user_data)
+        self._handles = []
+        self.add_callback(callback, user_data, handle)
 
-    def add_callback(self, callback, user_data):
+    def add_callback(self, callback, user_data, handle):
+        self._handles.append(handle)
         if callback is not None:
-            self._callbacks.append((callback, user_data))
+            self._callbacks.append((callback, user_data, handle))
+
+    def remove_handle(self, handle):
+        """
+        Forgets a cancelled handle and returns whether any other
+        handles are still waiting for the image.
+        """
+        self._handles = [h for h in self._handles if h is not handle]
+        self._callbacks = [c for c in self._callbacks if c[2] is not handle]
+        return len(self._handles) > 0
 
     def on_completion(self, art):
-        for callback, user_data in self._callbacks:
-            callback(art, user_data)
+        for callback, user_data, handle in self._callbacks:
+            if not handle.is_cancelled():
+                callback(art, user_data)
+
+    def on_failure(self):
+        for handle in self._handles:
+            handle.fail()
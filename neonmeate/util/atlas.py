@@ -0,0 +1,162 @@
+import json
+import logging
+import mmap
+import os
+
+import cairo
+
+from gi.repository import Gdk
+
+
+class ThumbnailAtlas:
+    """
+    Covers scaled to one edge size and packed as ARGB32 tiles, the
+    format cairo paints from, into a single memory mapped file. A JSON
+    index records which tile holds which cover. Tiles are handed out
+    as cairo surfaces over the mapping itself, so showing a cover that
+    is in the atlas takes no file opens and no decoding, and the OS
+    page cache decides which tiles stay in memory.
+
+    Covers are keyed by the caller, who should make the key change
+    when the cover file does. Tiles are never reused, so a replaced
+    cover leaves its old tile behind. The file is never shrunk while
+    it is mapped, as painting a tile past its end would crash.
+
+    An instance is not thread safe, it is meant to be used from the
+    GTK main thread.
+    """
+
+    # Number of tiles the file grows by at least, at a time
+    GrowTiles = 64
+
+    def __init__(self, directory, edge_size):
+        self._edge = edge_size
+        self._stride = cairo.ImageSurface.format_stride_for_width(
+            cairo.FORMAT_ARGB32,
+            edge_size
+        )
+        self._tile_bytes = self._stride * edge_size
+        self._tiles_file = os.path.join(directory, f'atlas-{edge_size}.tiles')
+        self._index_file = os.path.join(directory, f'atlas-{edge_size}.json')
+        self._tiles = {}
+        self._file = None
+        self._map = None
+        self._capacity = 0
+        self._dirty = False
+        self._log = logging.getLogger(__name__)
+        self._open(directory)
+
+    def __contains__(self, key):
+        return key in self._tiles
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def get(self, key):
+        """Returns the tile of the cover as a cairo surface, or None."""
+        slot = self._tiles.get(key, None)
+        if slot is None:
+            return None
+        return self._tile_surface(slot)
+
+    def add(self, key, pixbuf):
+        """
+        Stores the pixbuf, which should be edge_size pixels square, as
+        the tile of the cover and returns the tile. If the atlas cannot
+        be written, the tile is returned all the same, but it is not
+        kept.
+        """
+        if key in self._tiles:
+            return self.get(key)
+        slot = len(self._tiles)
+        tile = None
+        if self._file is not None:
+            try:
+                self._reserve(slot + 1)
+                tile = self._tile_surface(slot)
+            except OSError as e:
+                self._log.warning(f'Failed to grow {self._tiles_file}: {e}')
+        if tile is None:
+            tile = cairo.ImageSurface(
+                cairo.FORMAT_ARGB32,
+                self._edge,
+                self._edge
+            )
+        else:
+            self._tiles[key] = slot
+            self._dirty = True
+        ctx = cairo.Context(tile)
+        ctx.set_operator(cairo.OPERATOR_SOURCE)
+        Gdk.cairo_set_source_pixbuf(ctx, pixbuf, 0, 0)
+        ctx.paint()
+        tile.flush()
+        return tile
+
+    def save(self):
+        """Persists the index, and the tiles along with it."""
+        if not self._dirty or self._file is None:
+            return
+        try:
+            if self._map is not None:
+                self._map.flush()
+            tmp_file = f'{self._index_file}.tmp'
+            with open(tmp_file, 'w') as f:
+                json.dump({'edge': self._edge, 'tiles': self._tiles}, f)
+            os.replace(tmp_file, self._index_file)
+            self._dirty = False
+        except OSError as e:
+            self._log.warning(f'Failed to save {self._index_file}: {e}')
+
+    def _tile_surface(self, slot):
+        start = slot * self._tile_bytes
+        return cairo.ImageSurface.create_for_data(
+            memoryview(self._map)[start:start + self._tile_bytes],
+            cairo.FORMAT_ARGB32,
+            self._edge,
+            self._edge,
+            self._stride
+        )
+
+    def _reserve(self, tiles):
+        if tiles <= self._capacity:
+            return
+        capacity = max(tiles, 2 * self._capacity, ThumbnailAtlas.GrowTiles)
+        size = capacity * self._tile_bytes
+        self._file.truncate(size)
+        # Surfaces handed out earlier keep the old mapping alive for
+        # as long as they need it, so it is left to be collected
+        # rather than closed.
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._capacity = capacity
+
+    def _open(self, directory):
+        try:
+            os.makedirs(directory, exist_ok=True)
+            fd = os.open(self._tiles_file, os.O_RDWR | os.O_CREAT, 0o644)
+            self._file = os.fdopen(fd, 'r+b')
+            size = os.fstat(fd).st_size
+        except OSError as e:
+            self._log.warning(f'Not using {self._tiles_file}: {e}')
+            self._file = None
+            return
+        self._tiles = self._load_index()
+        if len(self._tiles) * self._tile_bytes > size:
+            # The index refers to tiles that were never written
+            self._tiles = {}
+            self._dirty = True
+        self._capacity = size // self._tile_bytes
+        if self._capacity > 0:
+            self._map = mmap.mmap(fd, self._capacity * self._tile_bytes)
+
+    def _load_index(self):
+        if not os.path.exists(self._index_file):
+            return {}
+        try:
+            with open(self._index_file, 'r') as f:
+                index = json.load(f)
+            if index.get('edge') != self._edge:
+                return {}
+            return index['tiles']
+        except (OSError, ValueError, KeyError) as e:
+            self._log.warning(f'Ignoring atlas index {self._index_file}: {e}')
+            return {}
@@ -1,10 +1,18 @@
+import math
 import random
 import sys
 
+from array import array
+
 from gi.repository import GdkPixbuf
 
 from neonmeate.util.color import RGBColor
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 def triplet_mean(elements):
     n = len(elements)
@@ -30,23 +38,167 @@ class Image:
         self.width = pixbuf.get_width()
         self.height = pixbuf.get_height()
         self.stride = pixbuf.get_rowstride()
+        self.channels = pixbuf.get_n_channels()
         self.bytes = pixbuf.get_pixels()
 
     def color(self, row, col):
-        p = row * self.stride + col * 3
+        p = row * self.stride + col * self.channels
         return self.bytes[p], self.bytes[p + 1], self.bytes[p + 2]
 
+    def pixel_array(self):
+        """
+        Returns the RGB components of the pixels, in row order, as an
+        (N, 3) NumPy array of floats between 0 and 1, along with a
+        boolean array telling which of them are not fully transparent.
+        """
+        row_bytes = self.width * self.channels
+        # The last row may stop short of the rowstride
+        data = np.zeros(self.height * self.stride, dtype=np.uint8)
+        data[:len(self.bytes)] = np.frombuffer(self.bytes, dtype=np.uint8)
+        pixels = data.reshape(self.height, self.stride)[:, :row_bytes]
+        pixels = pixels.reshape(self.width * self.height, self.channels)
+        if self.channels == 4:
+            opaque = pixels[:, 3] > 0
+        else:
+            opaque = np.ones(len(pixels), dtype=bool)
+        return pixels[:, :3] / 255.0, opaque
+
+    def pixels_at(self, indices):
+        """
+        Like pixel_array(), but only for the pixels at the given
+        indices into the pixels in row order.
+        """
+        data = np.frombuffer(self.bytes, dtype=np.uint8)
+        rows, cols = np.divmod(indices, self.width)
+        offsets = rows * self.stride + cols * self.channels
+        rgb = np.stack([data[offsets + j] for j in range(3)], axis=1)
+        if self.channels == 4:
+            opaque = data[offsets + 3] > 0
+        else:
+            opaque = np.ones(len(indices), dtype=bool)
+        return rgb / 255.0, opaque
+
+
+def rgb_to_norm_hsv(rgb):
+    """
+    Converts an (N, 3) array of RGB colors to the components of
+    RGBColor.to_norm_hsv(), as an (N, 3) array.
+    """
+    r, g, b = rgb[:, 0], rgb[:, 1], rgb[:, 2]
+    maxc = rgb.max(axis=1)
+    minc = rgb.min(axis=1)
+    delta = maxc - minc
+    chromatic = delta > 0
+    safe_delta = np.where(chromatic, delta, 1.0)
+    s = np.where(chromatic, delta / np.where(maxc > 0, maxc, 1.0), 0.0)
+    rc = (maxc - r) / safe_delta
+    gc = (maxc - g) / safe_delta
+    bc = (maxc - b) / safe_delta
+    h = np.where(
+        r == maxc,
+        bc - gc,
+        np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc)
+    )
+    h = np.where(chromatic, (h / 6.0) % 1.0, 0.0)
+    return np.stack([RGBColor.TwoPi * h, s, maxc], axis=1)
+
+
+def color_histogram(rgb, bits):
+    """
+    Quantizes an (N, 3) array of RGB colors to the given number of
+    bits per channel, and returns the occupied bins: the mean color of
+    each bin as a (B, 3) array, the number of colors in each bin, and
+    the index of the bin of each color.
+    """
+    shift = 8 - bits
+    q = np.rint(rgb * 255.0).astype(np.int64) >> shift
+    keys = (q[:, 0] << (2 * bits)) | (q[:, 1] << bits) | q[:, 2]
+    # Only the occupied bins are materialized, as a table of every
+    # possible bin has 2 ** (3 * bits) entries.
+    _, inverse, counts = np.unique(keys, return_inverse=True,
+                                   return_counts=True)
+    inverse = inverse.reshape(-1)
+    colors = np.empty((len(counts), 3))
+    for j in range(3):
+        colors[:, j] = np.bincount(inverse, weights=rgb[:, j]) / counts
+    return colors, counts, inverse
+
+
+def kmeans_pp_seeds(embedded, k, rng, weights=None):
+    """
+    Picks k seeds among the points with k-means++: the first one at
+    random, and each next one with a probability proportional to its
+    squared distance from the nearest seed picked so far, times its
+    weight if weights are given. All draws come from rng, so the seeds
+    are reproducible from its state.
+
+    The points are an (N, 3) NumPy array, or a list of 3-tuples when
+    numpy is not installed, embedded by the color space. Weights are
+    only supported with numpy.
+
+    :return: the indices of the seeds, fewer than k if there are not
+    enough distinct points
+    """
+    n = len(embedded)
+    if n == 0:
+        return []
+    seeds = [rng.randrange(n)]
+    if np is None:
+        return _kmeans_pp_seeds_py(embedded, k, rng, seeds)
+    nearest_sq = np.full(n, np.inf)
+    while len(seeds) < min(k, n):
+        offsets = embedded - embedded[seeds[-1]]
+        np.minimum(
+            nearest_sq,
+            np.einsum('ij,ij->i', offsets, offsets),
+            out=nearest_sq
+        )
+        if weights is None:
+            cumulative = np.cumsum(nearest_sq)
+        else:
+            cumulative = np.cumsum(nearest_sq * weights)
+        if cumulative[-1] <= 0:
+            break
+        target = rng.random() * cumulative[-1]
+        i = int(np.searchsorted(cumulative, target, side='right'))
+        seeds.append(min(i, n - 1))
+    return seeds
+
+
+def _kmeans_pp_seeds_py(embedded, k, rng, seeds):
+    nearest_sq = [math.inf] * len(embedded)
+    while len(seeds) < min(k, len(embedded)):
+        sx, sy, sz = embedded[seeds[-1]]
+        total = 0.0
+        for i, (x, y, z) in enumerate(embedded):
+            sq = (x - sx) ** 2 + (y - sy) ** 2 + (z - sz) ** 2
+            if sq < nearest_sq[i]:
+                nearest_sq[i] = sq
+            total += nearest_sq[i]
+        if total <= 0:
+            break
+        target = rng.random() * total
+        cumulative = 0.0
+        pick = len(embedded) - 1
+        for i, sq in enumerate(nearest_sq):
+            cumulative += sq
+            if cumulative > target:
+                pick = i
+                break
+        seeds.append(pick)
+    return seeds
+
 
 class Cluster:
 
-    def __init__(self, label, initial_value, mean_fn, colorspace):
+    def __init__(self, label, initial_value, mean_fn, colorspace, count=0):
         self._colorspace = colorspace
         self.label = label
         self.dist_fn = colorspace.distance
         self.mean_fn = mean_fn
         self._centroid = initial_value
         self.elements = []
-        self._count = 0
+        self._count = count
 
     def count(self):
         return self._count
@@ -93,6 +245,22 @@ class RGBColorSpace:
     def to_rgbcolor(a, b, c):
         return RGBColor(a, b, c)
 
+    @staticmethod
+    def from_rgb_array(rgb):
+        return rgb
+
+    @staticmethod
+    def embed(points):
+        """
+        Maps an (N, 3) array of colors to points whose squared
+        euclidean distances order the colors as distance() does.
+        """
+        return points
+
+    @staticmethod
+    def embed_color(a, b, c):
+        return a, b, c
+
 
 class HSVColorSpace:
 
@@ -112,8 +280,34 @@ class HSVColorSpace:
     def to_rgbcolor(a, b, c):
         return RGBColor.from_hsv(a, b, c)
 
+    @staticmethod
+    def from_rgb_array(rgb):
+        return rgb_to_norm_hsv(rgb)
+
+    @staticmethod
+    def embed(points):
+        """
+        Maps an (N, 3) array of colors to points whose squared
+        euclidean distances are the distances of distance().
+        """
+        h, s, v = points[:, 0], points[:, 1], points[:, 2]
+        return np.stack([np.sin(h) * s * v, np.cos(h) * s * v, 2.0 * v],
+                        axis=1)
+
+    @staticmethod
+    def embed_color(h, s, v):
+        return math.sin(h) * s * v, math.cos(h) * s * v, 2.0 * v
+
 
 class ColorClusterer:
+    """
+    K-means clustering of the colors of an image, in plain Python.
+
+    The cluster of each pixel is kept as a label in an array, in row
+    order. A label is the index of one of the initial clusters, and
+    the label table maps it to the cluster it now stands for, so that
+    merging clusters only updates the table, not the pixels.
+    """
 
     @staticmethod
     def color_at(img, x, y, colorspace):
@@ -129,47 +323,30 @@ class ColorClusterer:
         self._rng = rng
         self.rounds = []
         self.clusters = []
-        self.cluster_assignments = {}
+        self.labels = array('i')
+        self._width = 0
+        self._label_clusters = []
+        self._label_of = {}
 
     def _init_clusters(self, img):
-        def getcolor(px, py):
-            return ColorClusterer.color_at(img, px, py, self._colorspace)
-
-        x, y = self._rng.randrange(0, img.width), self._rng.randrange(0,
-                                                                      img.height)
-        cluster = Cluster(f'Cluster 0', getcolor(x, y), triplet_mean,
-                          self._colorspace)
-        self.clusters.append(cluster)
-
-        points = []
-        cluster_points = {(x, y)}
-
-        def nearest(point):
-            a, b = point
-            return self._nearest_cluster(getcolor(a, b))
-
-        for x in range(img.width):
-            for y in range(img.height):
-                points.append((x, y))
-
-        while len(self.clusters) < self._k:
-            max_dsquared = float('-inf')
-            max_p = None
-            for p in points:
-                if p not in cluster_points:
-                    x, y = p
-                    closest = nearest(p)
-                    col = getcolor(x, y)
-                    d = closest.distance(col)
-                    ds = d * d
-                    if ds > max_dsquared:
-                        max_dsquared = ds
-                        max_p = p
-            i = len(self.clusters)
-            cent = Cluster(f'Cluster {i}', getcolor(max_p[0], max_p[1]),
-                           triplet_mean, self._colorspace)
-            self.clusters.append(cent)
-            cluster_points.add(max_p)
+        space = self._colorspace
+        if np is not None:
+            rgb, opaque = img.pixel_array()
+            points = space.from_rgb_array(rgb[opaque])
+            seeds = kmeans_pp_seeds(space.embed(points), self._k, self._rng)
+            initial = [tuple(float(x) for x in points[i]) for i in seeds]
+        else:
+            colors = [c for _, _, c in ColorClusterer.each_img_color(img,
+                                                                    space)]
+            embedded = [space.embed_color(*c) for c in colors]
+            seeds = kmeans_pp_seeds(embedded, self._k, self._rng)
+            initial = [colors[i] for i in seeds]
+        for i, color in enumerate(initial):
+            self.clusters.append(
+                Cluster(f'Cluster {i}', color, triplet_mean, space)
+            )
+        self._label_clusters = list(self.clusters)
+        self._label_of = {c: i for i, c in enumerate(self.clusters)}
 
     @staticmethod
     def each_img_color(img, colorspace):
@@ -214,9 +391,9 @@ class ColorClusterer:
         to_prune = clusters[1:]
         for c in to_prune:
             merged.add(c.centroid())
-            for (x, y), cl in self.cluster_assignments.items():
-                if cl == c:
-                    self.cluster_assignments[(x, y)] = merged
+        for label, cl in enumerate(self._label_clusters):
+            if cl in to_prune:
+                self._label_clusters[label] = merged
         self.clusters = [c for c in self.clusters if c not in to_prune]
         merged.recalc_centroid()
 
@@ -232,6 +409,8 @@ class ColorClusterer:
         itercount = 0
         maxiters = self._max_iters
         thresh = 0.01
+        width = self._width = img.width
+        self.labels = array('i', [-1]) * (width * img.height)
 
         while itercount < maxiters:
             orig_means = [c.centroid() for c in self.clusters]
@@ -242,7 +421,7 @@ class ColorClusterer:
             for x, y, components in ColorClusterer.each_img_color(img,
                                                                   self._colorspace):
                 c = self._add_to_nearest(components)
-                self.cluster_assignments[(x, y)] = c
+                self.labels[y * width + x] = self._label_of[c]
 
             self._recalc_centroids()
             self._merge_similar()
@@ -257,6 +436,303 @@ class ColorClusterer:
 
             itercount += 1
 
+    def label_table(self):
+        """
+        Returns the label of each pixel in row order, -1 for pixels
+        that were not clustered, and the clusters the labels stand for.
+        """
+        return self.labels, self._label_clusters
+
+    def cluster_at(self, x, y):
+        if not self.labels:
+            return None
+        label = self.labels[y * self._width + x]
+        return self._label_clusters[label] if label >= 0 else None
+
+
+class VectorColorClusterer:
+    """
+    The same k-means clustering as ColorClusterer, but with the
+    pixels held in NumPy arrays, so that assigning them to clusters,
+    recomputing the centroids and checking for convergence are array
+    operations instead of Python loops over every pixel. Clusters that
+    come within the cluster threshold of each other are merged after
+    each round, weighted by their pixel counts. Fully transparent
+    pixels are left out. Requires numpy.
+
+    If histogram_bits is given, the colors are first quantized to that
+    many bits per channel, and the clustering runs over the occupied
+    bins, weighted by their pixel counts, instead of over the pixels.
+    Covers have few distinct colors, so with 5 bits this takes a few
+    thousand points whatever the size of the image.
+    """
+
+    def __init__(self, num_clusters, cluster_threshold, rng, max_iters, space,
+                 histogram_bits=None):
+        self._k = num_clusters
+        self._histogram_bits = histogram_bits
+        self._max_iters = max_iters
+        self._cluster_threshold = cluster_threshold
+        self._colorspace = space
+        self._rng = rng
+        self.rounds = []
+        self.clusters = []
+        self.labels = None
+
+    def _distance(self, u, v):
+        return self._colorspace.distance(u[0], u[1], u[2], v[0], v[1], v[2])
+
+    def _init_centroids(self, points, embedded, weights):
+        return points[kmeans_pp_seeds(embedded, self._k, self._rng, weights)]
+
+    def _assign(self, embedded, centroids):
+        c = self._colorspace.embed(centroids)
+        # |p - c|^2 expanded, so that only an (N, k) array is made
+        sq = np.einsum('ij,ij->i', embedded, embedded)[:, None] \
+            - 2.0 * embedded @ c.T \
+            + np.einsum('ij,ij->i', c, c)[None, :]
+        return np.argmin(sq, axis=1)
+
+    def _update_centroids(self, points, weights, labels, centroids):
+        k = len(centroids)
+        counts = np.bincount(labels, weights=weights, minlength=k)
+        updated = centroids.copy()
+        occupied = counts > 0
+        for j in range(3):
+            values = points[:, j] if weights is None \
+                else points[:, j] * weights
+            sums = np.bincount(labels, weights=values, minlength=k)
+            updated[occupied, j] = sums[occupied] / counts[occupied]
+        return updated, counts
+
+    def _merge_similar(self, centroids, counts, labels):
+        k = len(centroids)
+        target = np.arange(k)
+        for i in range(k):
+            if target[i] != i:
+                continue
+            for j in range(i + 1, k):
+                if target[j] == j and self._distance(
+                        centroids[i], centroids[j]) < self._cluster_threshold:
+                    target[j] = i
+        kept = np.flatnonzero(target == np.arange(k))
+        if len(kept) == k:
+            return centroids, counts, labels, False
+        merged = np.empty((len(kept), 3))
+        merged_counts = np.empty(len(kept), dtype=counts.dtype)
+        for n, i in enumerate(kept):
+            members = target == i
+            total = counts[members].sum()
+            merged_counts[n] = total
+            if total > 0:
+                merged[n] = counts[members] @ centroids[members] / total
+            else:
+                merged[n] = centroids[i]
+        relabel = np.searchsorted(kept, target)
+        return merged, merged_counts, relabel[labels], True
+
+    def cluster(self, img):
+        rgb, opaque = img.pixel_array()
+        rgb = rgb[opaque]
+        weights = None
+        bin_of_pixel = None
+        if self._histogram_bits is not None:
+            rgb, weights, bin_of_pixel = color_histogram(
+                rgb,
+                self._histogram_bits
+            )
+        points = self._colorspace.from_rgb_array(rgb)
+        if len(points) == 0:
+            return
+        embedded = self._colorspace.embed(points)
+        centroids = self._init_centroids(points, embedded, weights)
+        if len(centroids) < 2:
+            return
+
+        thresh = 0.01
+        labels = None
+
+        for _ in range(self._max_iters):
+            self.rounds.append(
+                [self._colorspace.to_rgbcolor(*c) for c in centroids]
+            )
+            labels = self._assign(embedded, centroids)
+            updated, counts = self._update_centroids(
+                points,
+                weights,
+                labels,
+                centroids
+            )
+            updated, counts, labels, merged = self._merge_similar(
+                updated,
+                counts,
+                labels
+            )
+            converged = not merged and all(
+                self._distance(u, v) < thresh
+                for u, v in zip(centroids, updated)
+            )
+            centroids = updated
+            if converged:
+                break
+
+        if labels is None:
+            return
+        if bin_of_pixel is not None:
+            labels = labels[bin_of_pixel]
+        # Clusters left without pixels are dropped
+        occupied = np.flatnonzero(counts > 0)
+        self.clusters = [
+            Cluster(f'Cluster {n}', tuple(centroids[i]), triplet_mean,
+                    self._colorspace, int(counts[i]))
+            for n, i in enumerate(occupied)
+        ]
+        relabel = np.full(len(centroids), -1, dtype=np.intp)
+        relabel[occupied] = np.arange(len(occupied))
+        self.labels = np.full(img.width * img.height, -1, dtype=np.intp)
+        self.labels[opaque] = relabel[labels]
+        self.labels = self.labels.reshape(img.height, img.width)
+
+    def label_table(self):
+        """
+        Returns the label of each pixel in row order, -1 for pixels
+        that were not clustered, and the clusters the labels stand for.
+        """
+        if self.labels is None:
+            return np.empty(0, dtype=np.intp), self.clusters
+        return self.labels.ravel(), self.clusters
+
+    def cluster_at(self, x, y):
+        if self.labels is None or self.labels[y, x] < 0:
+            return None
+        return self.clusters[self.labels[y, x]]
+
+
+class MiniBatchColorClusterer(VectorColorClusterer):
+    """
+    Mini-batch k-means, which looks at a fixed number of pixels per
+    round rather than at all of them. Each round draws a new random
+    sample of batch_size pixels and moves every centroid towards the
+    mean of its pixels in the sample, by a step that shrinks as the
+    cluster sees more pixels. Clustering stops once no centroid moves
+    by tolerance or more in a round. The time a round takes depends on
+    batch_size only, not on the size of the image. Requires numpy.
+
+    The labels of the pixels are only worked out when label_table() or
+    cluster_at() is first called.
+    """
+
+    def __init__(self, num_clusters, cluster_threshold, rng, max_iters, space,
+                 batch_size, tolerance=0.01):
+        super(MiniBatchColorClusterer, self).__init__(
+            num_clusters,
+            cluster_threshold,
+            rng,
+            max_iters,
+            space
+        )
+        self._batch_size = batch_size
+        self._tolerance = tolerance
+        self._img = None
+        self._sampler = None
+
+    def _sample(self):
+        n = self._img.width * self._img.height
+        indices = self._sampler.integers(0, n, self._batch_size)
+        rgb, opaque = self._img.pixels_at(indices)
+        return self._colorspace.from_rgb_array(rgb[opaque])
+
+    def cluster(self, img):
+        self._img = img
+        if img.width * img.height == 0:
+            return
+        self._sampler = np.random.default_rng(self._rng.getrandbits(64))
+        points = self._sample()
+        if len(points) == 0:
+            return
+        embed = self._colorspace.embed
+        centroids = self._init_centroids(points, embed(points), None)
+        if len(centroids) < 2:
+            return
+        seen = np.zeros(len(centroids))
+
+        for _ in range(self._max_iters):
+            self.rounds.append(
+                [self._colorspace.to_rgbcolor(*c) for c in centroids]
+            )
+            points = self._sample()
+            if len(points) == 0:
+                break
+            labels = self._assign(embed(points), centroids)
+            batch_means, batch_counts = self._update_centroids(
+                points,
+                None,
+                labels,
+                centroids
+            )
+            seen += batch_counts
+            step = np.divide(
+                batch_counts,
+                seen,
+                out=np.zeros(len(seen)),
+                where=seen > 0
+            )
+            updated = centroids + step[:, None] * (batch_means - centroids)
+            updated, seen, _, merged = self._merge_similar(
+                updated,
+                seen,
+                labels
+            )
+            converged = not merged and all(
+                self._distance(u, v) < self._tolerance
+                for u, v in zip(centroids, updated)
+            )
+            centroids = updated
+            if converged:
+                break
+
+        self.clusters = [
+            Cluster(f'Cluster {n}', tuple(centroids[i]), triplet_mean,
+                    self._colorspace, int(seen[i]))
+            for n, i in enumerate(np.flatnonzero(seen > 0))
+        ]
+
+    def label_table(self):
+        self._label_pixels()
+        return super(MiniBatchColorClusterer, self).label_table()
+
+    def cluster_at(self, x, y):
+        self._label_pixels()
+        return super(MiniBatchColorClusterer, self).cluster_at(x, y)
+
+    def _label_pixels(self):
+        if self.labels is None and self.clusters:
+            rgb, opaque = self._img.pixel_array()
+            points = self._colorspace.from_rgb_array(rgb[opaque])
+            centroids = np.array([c.centroid() for c in self.clusters])
+            labels = np.full(len(opaque), -1, dtype=np.intp)
+            labels[opaque] = self._assign(
+                self._colorspace.embed(points),
+                centroids
+            )
+            self.labels = labels.reshape(self._img.height, self._img.width)
+
+
+def clusterer_for(engine):
+    """
+    Returns the clusterer class for the engine, which is 'python',
+    'numpy', or 'auto' to use numpy when it is installed.
+    """
+    if engine == 'auto':
+        engine = 'python' if np is None else 'numpy'
+    if engine == 'numpy':
+        if np is None:
+            raise ValueError('the numpy engine requires numpy')
+        return VectorColorClusterer
+    if engine == 'python':
+        return ColorClusterer
+    raise ValueError(f'unknown clustering engine: {engine}')
+
 
 def output(imgpath, clusters, rounds, colorspace):
     s = f"""
@@ -301,17 +777,43 @@ def space_for(space):
 
 
 def clusterize(pixbuf, rng, percent=25, k=7, cluster_thresh=0.6, max_iters=200,
-               space='hsv'):
+               space='hsv', engine='auto', histogram_bits=None,
+               pixel_budget=None):
+    """
+    Clusters the colors of the pixbuf. The pixbuf is scaled down to
+    the given percentage first, unless it is small or a pixel budget
+    is given. With a pixel budget, mini-batch k-means is used, which
+    samples that many pixels per round from the full image. Histogram
+    binning and pixel budgets require the numpy engine.
+    """
     assert pixbuf.get_bits_per_sample() == 8
     assert pixbuf.get_colorspace() == GdkPixbuf.Colorspace.RGB
 
-    if pixbuf.get_height() > 200 and pixbuf.get_width() > 200:
+    if histogram_bits is not None and pixel_budget is not None:
+        raise ValueError('histogram binning and a pixel budget '
+                         'cannot be combined')
+
+    if pixel_budget is None and \
+            pixbuf.get_height() > 200 and pixbuf.get_width() > 200:
         sw, sh = scale_dimensions(pixbuf, percent)
         pixbuf = pixbuf.scale_simple(sw, sh, GdkPixbuf.InterpType.BILINEAR)
 
     img = Image(pixbuf)
     color_space = space_for(space)
-    clusterer = ColorClusterer(k, cluster_thresh, rng, max_iters, color_space)
+    clusterer_class = clusterer_for(engine)
+    if histogram_bits is None and pixel_budget is None:
+        clusterer = clusterer_class(k, cluster_thresh, rng, max_iters,
+                                    color_space)
+    elif clusterer_class is not VectorColorClusterer:
+        raise ValueError('histogram binning and pixel budgets require '
+                         'the numpy engine')
+    elif histogram_bits is not None:
+        clusterer = VectorColorClusterer(k, cluster_thresh, rng, max_iters,
+                                         color_space, histogram_bits)
+    else:
+        clusterer = MiniBatchColorClusterer(k, cluster_thresh, rng,
+                                            max_iters, color_space,
+                                            pixel_budget)
     clusterer.cluster(img)
     clusters = clusterer.clusters
 
@@ -360,6 +862,24 @@ def scale_dimensions(pixbuf, percentage):
     return new_width, new_height
 
 
+def benchmark(pixbuf, parsed):
+    import time
+
+    bits = parsed.bins or 5
+    for label, histogram_bits in [('pixels', None),
+                                  (f'{bits} bit histogram', bits)]:
+        times = []
+        for i in range(parsed.benchmark):
+            rng = random.Random(i)
+            start = time.perf_counter()
+            clusterize(pixbuf, rng, parsed.pct, parsed.k, parsed.thresh,
+                       parsed.iters, parsed.space, 'numpy', histogram_bits)
+            times.append(time.perf_counter() - start)
+        times.sort()
+        print(f'{label}: best {times[0]:.4f}s, '
+              f'median {times[len(times) // 2]:.4f}s')
+
+
 def main(args):
     from PIL import Image
     import argparse
@@ -378,21 +898,38 @@ def main(args):
                         default=100, type=int)
     parser.add_argument('-s', '--space', help='color space for distance',
                         choices=['rgb', 'hsv'], default='hsv')
+    parser.add_argument('-e', '--engine', help='clustering implementation',
+                        choices=['auto', 'python', 'numpy'], default='auto')
+    parser.add_argument('-b', '--bins', help='cluster a color histogram '
+                        'with this many bits per channel', type=int)
+    parser.add_argument('--budget', help='use mini-batch k-means over '
+                        'this many pixels per round', type=int)
+    parser.add_argument('--benchmark', help='time clustering the pixels '
+                        'against clustering a histogram, this many times '
+                        'each', type=int)
     parsed = parser.parse_args(args)
 
     if parsed.pct < 0 or parsed.pct > 100:
         raise Exception(f'invalid percentage option: {parsed.pct}')
+    if parsed.bins is not None and not 1 <= parsed.bins <= 8:
+        raise Exception(f'invalid bits option: {parsed.bins}')
+    if parsed.budget is not None and parsed.budget < 1:
+        raise Exception(f'invalid pixel budget option: {parsed.budget}')
 
     with open(parsed.file, 'rb') as f:
         pixbuf = pixbuf_from_file(f)
 
-    scaled_width, scaled_height = scale_dimensions(pixbuf, parsed.pct)
+    if parsed.benchmark:
+        benchmark(pixbuf, parsed)
+        return
+
     rng = random.Random()
     rng.seed(int(1000 * time.time()))
 
     clusterer, pixbuf_img, clusters, rounds = \
         clusterize(pixbuf, rng, parsed.pct, parsed.k, parsed.thresh,
-                   parsed.iters, parsed.space)
+                   parsed.iters, parsed.space, parsed.engine, parsed.bins,
+                   parsed.budget)
     colorspace = space_for(parsed.space)
     for c in clusters:
         dist_dict = {}
@@ -405,16 +942,16 @@ def main(args):
             )
         c.dist_dict = dist_dict
 
-    im = Image.new('RGB', (scaled_width, scaled_height))
-
-    for row in range(scaled_height):
-        for col in range(scaled_width):
-            clust = clusterer.cluster_assignments[(col, row)]
-            a, b, c = clust.centroid()
-            rgb = colorspace.to_rgb_256_tuple(a, b, c)
-            im.putpixel((col, row), rgb)
-
-    im.save('/tmp/cluster.jpg')
+    labels, label_clusters = clusterer.label_table()
+    palette = [bytes(colorspace.to_rgb_256_tuple(*c.centroid()))
+               for c in label_clusters]
+    black = bytes(3)
+    pixels = b''.join(palette[label] if label >= 0 else black
+                      for label in labels)
+    if len(pixels) == 3 * pixbuf_img.width * pixbuf_img.height:
+        im = Image.frombytes('RGB', (pixbuf_img.width, pixbuf_img.height),
+                             pixels)
+        im.save('/tmp/cluster.jpg')
     output(parsed.file, clusters, rounds, colorspace)
 
 
@@ -10,7 +10,9 @@ class ConfigKey:
     CONN_SETTINGS = 'nmpd'
     CONN_HOST = 'host'
     CONN_PORT = 'port'
-    CONN_HB = 'hb'
+    CONN_POLL = 'poll_interval'
+    CONN_IDLE = 'idle'
+    CONN_ASYNCIO = 'asyncio'
     CONNECTED = 'connected'
     ALBUM_SIZE = 'album_size'
 
@@ -32,6 +34,19 @@ def user_config_dir():
     return os.path.join(user_home(), ".config")
 
 
+def neonmeate_cache_dir():
+    return os.path.join(user_cache_dir(), 'neonmeate')
+
+
+def user_cache_dir():
+    cache_home = os.getenv('XDG_CACHE_HOME')
+
+    if cache_home:
+        return os.path.abspath(cache_home)
+
+    return os.path.join(user_home(), ".cache")
+
+
 def user_home():
     return os.path.expanduser("~")
 
@@ -51,6 +66,12 @@ class Config:
 
         'background_cache': {},
 
+        # Pixels sampled per round when clustering the colors of a
+        # cover for its gradient background, so that the cost does not
+        # depend on the cover's resolution. This needs numpy; without
+        # it, or when set to 0, the cover is scaled down instead.
+        'palette_pixel_budget': 4096,
+
         # Whether to include compilation appearances among an
         # artist's albums in the library view
         'albums_include_comps': True,
@@ -60,7 +81,17 @@ class Config:
         ConfigKey.CONN_SETTINGS: {
             ConfigKey.CONN_HOST: 'localhost',
             ConfigKey.CONN_PORT: 6600,
-            ConfigKey.CONN_HB: 500
+            # Milliseconds between status polls. The elapsed time of
+            # the playing song is advanced locally in between. This
+            # replaces the 'hb' setting, whose 500 ms default was
+            # saved into existing configs.
+            ConfigKey.CONN_POLL: 3000,
+            # Whether the heartbeat should park a connection in MPD's
+            # idle command rather than only polling the status
+            ConfigKey.CONN_IDLE: True,
+            # Whether artist and album queries go through the asyncio
+            # client instead of the local library index
+            ConfigKey.CONN_ASYNCIO: False
         }
     }
 
@@ -122,7 +153,13 @@ class Config:
             json.dump(self._config, f)
 
     def mpd_hb_interval(self):
-        return self._config.get(ConfigKey.CONN_HB, 500)
+        return self[ConfigKey.CONN_SETTINGS][ConfigKey.CONN_POLL]
+
+    def mpd_use_idle(self):
+        return self[ConfigKey.CONN_SETTINGS][ConfigKey.CONN_IDLE]
+
+    def mpd_use_asyncio(self):
+        return self[ConfigKey.CONN_SETTINGS][ConfigKey.CONN_ASYNCIO]
 
     def album_size(self):
         return self[ConfigKey.ALBUM_SIZE]
@@ -152,6 +189,9 @@ class Config:
     def get_albums_include_comps(self):
         return self._config['albums_include_comps']
 
+    def palette_pixel_budget(self):
+        return self['palette_pixel_budget']
+
     def clear_background_cache(self):
         self._config['background_cache'] = {}
 
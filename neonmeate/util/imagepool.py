@@ -0,0 +1,99 @@
+import multiprocessing
+import os
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+from gi.repository import GdkPixbuf, GLib
+
+
+def _decode(path, edge_size):
+    """
+    Runs in a worker process. Decodes the image at path to edge_size
+    pixels square and leaves the pixels in a new shared memory block,
+    which the caller is responsible for unlinking.
+
+    :return: the name of the block, whether the pixels have an alpha
+    channel, the edge size and the number of bytes per row
+    """
+    from PIL import Image
+
+    with Image.open(path) as img:
+        # Lets JPEG images be scaled while decoding
+        img.draft('RGB', (edge_size, edge_size))
+        has_alpha = 'A' in img.getbands()
+        img = img.convert('RGBA' if has_alpha else 'RGB')
+        img = img.resize((edge_size, edge_size), Image.BILINEAR)
+        pixels = img.tobytes()
+    shm = shared_memory.SharedMemory(create=True, size=len(pixels))
+    try:
+        shm.buf[:len(pixels)] = pixels
+    except BaseException:
+        shm.close()
+        shm.unlink()
+        raise
+    shm.close()
+    rowstride = (4 if has_alpha else 3) * edge_size
+    return shm.name, has_alpha, edge_size, rowstride
+
+
+class ImagePool:
+    """
+    Decodes and scales images in worker processes, so that the work
+    does not compete with the UI for the GIL. The workers hand the
+    pixels back through shared memory rather than pickling them over
+    a pipe, and they are turned into a GdkPixbuf on the calling side.
+
+    The workers are started with the spawn method, since forking a
+    process that runs GTK and several threads is not safe.
+    """
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = max(1, min(4, len(os.sched_getaffinity(0)) - 1))
+        self._pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+    def submit(self, path, edge_size):
+        """
+        Decodes the image at path to edge_size pixels square in a
+        worker process. This can be called from any thread.
+
+        :return: a concurrent.futures.Future for the GdkPixbuf
+        """
+        result = Future()
+
+        def on_done(f):
+            try:
+                result.set_result(ImagePool._to_pixbuf(*f.result()))
+            except BaseException as e:
+                result.set_exception(e)
+
+        self._pool.submit(_decode, path, edge_size).add_done_callback(on_done)
+        return result
+
+    @staticmethod
+    def _to_pixbuf(shm_name, has_alpha, edge_size, rowstride):
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            # PyGObject only takes bytes for a GLib.Bytes and copies
+            # them, so the pixels are copied twice here, after which
+            # the block can go.
+            pixels = GLib.Bytes.new(bytes(shm.buf[:rowstride * edge_size]))
+        finally:
+            shm.close()
+            shm.unlink()
+        return GdkPixbuf.Pixbuf.new_from_bytes(
+            pixels,
+            GdkPixbuf.Colorspace.RGB,
+            has_alpha,
+            8,
+            edge_size,
+            edge_size,
+            rowstride
+        )
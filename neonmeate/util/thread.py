@@ -22,8 +22,8 @@ def signal_subscribe_on_main(connect_fn, signal_name, callback, *args):
 
 
 class EventLoopThread(threading.Thread):
-    def __init__(self, error_handler):
-        super(EventLoopThread, self).__init__(name='EventLoop', daemon=True)
+    def __init__(self, error_handler, name='EventLoop'):
+        super(EventLoopThread, self).__init__(name=name, daemon=True)
         self._queue = queue.SimpleQueue()
         self._running = False
         self._error_handler = error_handler
@@ -43,6 +43,7 @@ class EventLoopThread(threading.Thread):
 
     def stop(self):
         self._running = False
+        self._queue.put(None)
 
 
 class ScheduledExecutor:
@@ -55,11 +56,13 @@ class ScheduledExecutor:
 
     def __init__(self, event_loop_err_handler, executor_err_handler):
         self._thread = EventLoopThread(event_loop_err_handler)
+        self._event_loop_error_handler = event_loop_err_handler
         self._scheduler = sched.scheduler(timefunc=time.monotonic)
         self._exec_error_handler = executor_err_handler
         ncpus = max(1, len(os.sched_getaffinity(0)) - 1)
         self._executor = ThreadPoolExecutor(max_workers=ncpus)
         self._single_exec = ThreadPoolExecutor(max_workers=1)
+        self._event_loops = []
         self._nullScheduledTask = NullCancelable()
         self._stopped = False
 
@@ -76,8 +79,22 @@ class ScheduledExecutor:
     def stop(self):
         self._stopped = True
         self._thread.stop()
+        for event_loop in self._event_loops:
+            event_loop.stop()
         self._executor.shutdown(wait=True)
 
+    def create_event_loop(self, name):
+        """
+        Starts an additional event loop thread, for work that must not
+        queue up behind the tasks on the main event loop. It shares the
+        error handler of the main event loop and is stopped along with
+        this executor.
+        """
+        event_loop = EventLoopThread(self._event_loop_error_handler, name)
+        self._event_loops.append(event_loop)
+        event_loop.start()
+        return event_loop
+
     def execute_async(self, task, *args, **kwargs):
         """
         Submits a task to the thread pool, not to the event loop
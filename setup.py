@@ -24,10 +24,12 @@ VERSION = '0.1.0'
 REQUIRED = [
     'python-mpd2',
     'pycairo',
+    'Pillow',
     'dateparser'
 ]
 
 EXTRAS = {
+    'numpy': ['numpy'],
 }
 
 here = os.path.abspath(os.path.dirname(__file__))